@@ -0,0 +1,397 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+
+import psutil
+from dotenv import load_dotenv
+from selenium import webdriver
+
+load_dotenv()
+
+
+def _process_alive(pid, create_time=None):
+    # Compare start times too, so a recycled pid is not mistaken for the original process
+    try:
+        process = psutil.Process(pid)
+        return create_time is None or abs(process.create_time() - create_time) < 1
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return False
+
+
+def _profile_owner_alive(profile):
+    # Profile directories are named <owner pid>-<owner start time>-<random>
+    try:
+        owner_pid, owner_create_time = os.path.basename(profile).split("-")[:2]
+        return _process_alive(int(owner_pid), float(owner_create_time))
+    except ValueError:
+        return False
+
+
+def _process_tree(pid):
+    try:
+        root = psutil.Process(pid)
+        return [root] + root.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+def _kill_tree(processes):
+    for process in processes:
+        try:
+            process.kill()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    psutil.wait_procs(processes, timeout=5)
+
+
+def _tree_rss(processes):
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return total
+
+
+class BrowserGovernor:
+    """
+    Tracks every chromedriver/Chrome process tree launched through `launch()`.
+
+    - At most `max_concurrent` browsers run host-wide; slots are files in `state_dir`, so every
+      process on the machine (Streamlit sessions, batch jobs) shares the same cap.
+    - A watchdog thread recycles (kills) browsers whose tree RSS or wall-clock age exceeds the
+      limits, which also unblocks a scrape stuck in WebDriverWait.
+    - At startup and every `reap_interval` seconds, browsers whose owning process is gone are
+      killed. Browsers are recognised by a per-launch profile directory under `state_dir`, so
+      Chrome instances this app did not start are never touched.
+    """
+
+    def __init__(self, max_rss_mb=None, max_lifetime=None, max_concurrent=None, reap_interval=None,
+                 check_interval=None, slot_timeout=None, state_dir=None):
+        self.max_rss = (max_rss_mb or int(os.getenv("BROWSER_MAX_RSS_MB", "2048"))) * 1024 * 1024
+        self.max_lifetime = max_lifetime or float(os.getenv("BROWSER_MAX_LIFETIME_S", "1800"))
+        self.max_concurrent = max_concurrent or int(os.getenv("BROWSER_MAX_CONCURRENT", "2"))
+        self.reap_interval = reap_interval or float(os.getenv("BROWSER_REAP_INTERVAL_S", "60"))
+        self.check_interval = check_interval or float(os.getenv("BROWSER_CHECK_INTERVAL_S", "5"))
+        self.slot_timeout = slot_timeout or float(os.getenv("BROWSER_SLOT_TIMEOUT_S", "600"))
+
+        self.state_dir = state_dir or os.getenv("BROWSER_STATE_DIR") or os.path.join(tempfile.gettempdir(), "scrapermaster-browsers")
+        self.slot_dir = os.path.join(self.state_dir, "slots")
+        self.profile_dir = os.path.join(self.state_dir, "profiles")
+        os.makedirs(self.slot_dir, exist_ok=True)
+        os.makedirs(self.profile_dir, exist_ok=True)
+
+        self.owner_pid = os.getpid()
+        self.owner_create_time = psutil.Process(self.owner_pid).create_time()
+
+        self._lock = threading.Lock()
+        self._browsers = {}  # chromedriver pid -> browser record
+        self.recycled = 0
+        self.reaped = 0
+        self._watchdog = None
+        self._stop = threading.Event()
+
+    # Host-wide slots
+
+    def _slot_path(self, number):
+        return os.path.join(self.slot_dir, f"slot-{number}.json")
+
+    def _read_slot(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _slot_stale(self, slot, path):
+        if slot is None:
+            # Unreadable: either being written right now or corrupt; only stale once it has aged
+            try:
+                return time.time() - os.path.getmtime(path) > 60
+            except FileNotFoundError:
+                return False
+        if not _process_alive(slot["owner_pid"], slot["owner_create_time"]):
+            return True
+        driver_pid = slot.get("driver_pid")
+        return driver_pid is not None and not _process_alive(driver_pid, slot.get("driver_create_time"))
+
+    def _take_slot_file(self, path, should_take):
+        """
+        Atomically move a slot file aside and re-check `should_take(slot, moved_path)` on what was
+        actually moved, so a slot that changed hands after we looked at it is never deleted.
+        Returns (moved_path, slot) when taken, or None (the file is put back if it was not ours to take).
+        """
+        moved_path = f"{path}.{uuid.uuid4().hex[:8]}.reclaim"
+        try:
+            os.rename(path, moved_path)
+        except FileNotFoundError:
+            return None
+        slot = self._read_slot(moved_path)
+        if should_take(slot, moved_path):
+            return moved_path, slot
+
+        try:
+            # link fails instead of overwriting if another process grabbed the number in between
+            os.link(moved_path, path)
+            os.remove(moved_path)
+        except FileExistsError:
+            # Still a live browser: it keeps counting against the cap until reap_orphans finds it stale
+            print(f"Browser slot {os.path.basename(path)} changed hands during reclaim; kept as {moved_path}")
+        return None
+
+    def _kept_aside(self):
+        """Live slots moved aside by a reclaim race (see _take_slot_file)."""
+        kept = 0
+        for name in os.listdir(self.slot_dir):
+            path = os.path.join(self.slot_dir, name)
+            if name.endswith(".reclaim") and not self._slot_stale(self._read_slot(path), path):
+                kept += 1
+        return kept
+
+    def _free_slot_file(self, path, slot):
+        # Kill the slot's browser tree if it is still running, then drop the file
+        killed = 0
+        if slot and slot.get("driver_pid") and _process_alive(slot["driver_pid"], slot.get("driver_create_time")):
+            tree = _process_tree(slot["driver_pid"])
+            _kill_tree(tree)
+            killed = len(tree)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return killed
+
+    def _reclaim_slot(self, path):
+        """
+        Free a stale slot. If its owner died while the browser kept running, the browser tree is
+        killed first so a freed slot never hides a live browser.
+        Returns the number of processes killed, or None if the slot was not reclaimed.
+        """
+        if not self._slot_stale(self._read_slot(path), path):
+            return None
+        taken = self._take_slot_file(path, self._slot_stale)
+        if taken is None:
+            return None
+        return self._free_slot_file(*taken)
+
+    def _try_acquire_slot(self):
+        for number in range(self.max_concurrent - self._kept_aside()):
+            path = self._slot_path(number)
+            if os.path.exists(path):
+                self._reclaim_slot(path)
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"owner_pid": self.owner_pid, "owner_create_time": self.owner_create_time}, f)
+            return path
+        return None
+
+    def acquire_slot(self):
+        deadline = time.monotonic() + self.slot_timeout
+        while True:
+            self.check()  # Frees slots of our own browsers that have already exited
+            slot = self._try_acquire_slot()
+            if slot:
+                return slot
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"No browser slot free after {self.slot_timeout:.0f}s "
+                                   f"({self.max_concurrent} browsers already running on this host)")
+            time.sleep(1)
+
+    def _write_slot(self, path, **fields):
+        slot = self._read_slot(path) or {"owner_pid": self.owner_pid, "owner_create_time": self.owner_create_time}
+        slot.update(fields)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(slot, f)
+        os.replace(tmp_path, path)
+
+    def _release_slot(self, path, driver_pid=None):
+        def ours(slot, _):
+            return (slot is not None and slot["owner_pid"] == self.owner_pid
+                    and slot.get("driver_pid") in (None, driver_pid))
+
+        taken = self._take_slot_file(path, ours)
+        if taken:
+            os.remove(taken[0])
+
+    # Launch and tracking
+
+    def launch(self, options):
+        """Start Chrome with `options` once a host-wide slot is free, and track its process tree."""
+        self.start()
+        slot = self.acquire_slot()
+        # The profile path marks the Chrome processes as ours and names the owning process
+        profile = os.path.join(self.profile_dir, f"{self.owner_pid}-{int(self.owner_create_time)}-{uuid.uuid4().hex[:8]}")
+        options.add_argument(f"--user-data-dir={profile}")
+        try:
+            driver = webdriver.Chrome(options=options)
+        except Exception:
+            self._release_slot(slot)
+            shutil.rmtree(profile, ignore_errors=True)
+            raise
+
+        driver_pid = driver.service.process.pid
+        driver_create_time = psutil.Process(driver_pid).create_time()
+        self._write_slot(slot, driver_pid=driver_pid, driver_create_time=driver_create_time)
+        with self._lock:
+            self._browsers[driver_pid] = {
+                "driver_pid": driver_pid,
+                "create_time": driver_create_time,
+                "started": time.monotonic(),
+                "slot": slot,
+                "profile": profile,
+            }
+        return driver
+
+    def _forget(self, browser):
+        self._browsers.pop(browser["driver_pid"], None)
+        self._release_slot(browser["slot"], browser["driver_pid"])
+        shutil.rmtree(browser["profile"], ignore_errors=True)
+
+    def check(self):
+        """Release browsers that have exited and recycle the ones over their memory or time limit."""
+        with self._lock:
+            for browser in list(self._browsers.values()):
+                if not _process_alive(browser["driver_pid"], browser["create_time"]):
+                    # Normal driver.quit()
+                    self._forget(browser)
+                    continue
+
+                tree = _process_tree(browser["driver_pid"])
+                rss = _tree_rss(tree)
+                age = time.monotonic() - browser["started"]
+                browser["rss"] = rss
+                browser["processes"] = len(tree)
+                if rss > self.max_rss or age > self.max_lifetime:
+                    reason = f"RSS {rss / 2**20:.0f} MB" if rss > self.max_rss else f"running for {age:.0f}s"
+                    print(f"Recycling browser {browser['driver_pid']} ({reason})")
+                    _kill_tree(tree)
+                    self.recycled += 1
+                    self._forget(browser)
+
+    def reap_orphans(self):
+        """Kill governed browsers (on this host) whose owning process no longer exists."""
+        reaped = 0
+        with self._lock:
+            tracked_profiles = {browser["profile"] for browser in self._browsers.values()}
+
+        # chromedriver processes, known from the slot files
+        for name in os.listdir(self.slot_dir):
+            path = os.path.join(self.slot_dir, name)
+            if name.endswith(".json"):
+                reaped += self._reclaim_slot(path) or 0
+            elif name.endswith(".reclaim"):
+                # Either left behind by a process that died mid-reclaim, or a live slot that could not be
+                # put back (see _take_slot_file): only freed once its owner or browser is gone as well
+                slot = self._read_slot(path)
+                if self._slot_stale(slot, path):
+                    reaped += self._free_slot_file(path, slot)
+
+        # Chrome processes left behind without their chromedriver, recognised by the profile marker
+        marker = f"--user-data-dir={self.profile_dir}"
+        orphans = []
+        for process in psutil.process_iter(["cmdline"]):
+            cmdline = process.info["cmdline"] or []
+            profile_arg = next((arg for arg in cmdline if arg.startswith(marker)), None)
+            if profile_arg is None:
+                continue
+            profile = profile_arg.split("=", 1)[1]
+            if profile not in tracked_profiles and not _profile_owner_alive(profile):
+                orphans.append(process)
+        _kill_tree(orphans)
+        reaped += len(orphans)
+
+        # Profiles of owners that are gone
+        for name in os.listdir(self.profile_dir):
+            if not _profile_owner_alive(name):
+                shutil.rmtree(os.path.join(self.profile_dir, name), ignore_errors=True)
+
+        if reaped:
+            print(f"Reaped {reaped} orphaned chrome/chromedriver processes")
+            with self._lock:
+                self.reaped += reaped
+        return reaped
+
+    # Watchdog
+
+    def start(self):
+        """Reap leftovers from earlier runs once, then keep checking on a timer."""
+        with self._lock:
+            if self._watchdog is not None:
+                return
+            self._stop.clear()
+            self._watchdog = threading.Thread(target=self._run, name="browser-governor", daemon=True)
+        self.reap_orphans()
+        self._watchdog.start()
+
+    def stop(self):
+        """Stop the watchdog thread (browsers already running are left alone)."""
+        with self._lock:
+            watchdog, self._watchdog = self._watchdog, None
+        if watchdog is not None:
+            self._stop.set()
+            watchdog.join()
+
+    def _run(self):
+        last_reap = time.monotonic()
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.check()
+                if time.monotonic() - last_reap >= self.reap_interval:
+                    self.reap_orphans()
+                    last_reap = time.monotonic()
+            except Exception as e:
+                print(f"Browser governor check failed: {e}")
+
+    def stats(self):
+        """Live browser counts and memory, for this process and the whole host."""
+        with self._lock:
+            browsers = [
+                {
+                    "driver_pid": b["driver_pid"],
+                    "age_s": round(time.monotonic() - b["started"]),
+                    "processes": b.get("processes", 0),
+                    "rss_mb": round(b.get("rss", 0) / 2**20),
+                }
+                for b in self._browsers.values()
+            ]
+            recycled, reaped = self.recycled, self.reaped
+
+        host_slots = [self._read_slot(os.path.join(self.slot_dir, name))
+                      for name in os.listdir(self.slot_dir) if name.endswith((".json", ".reclaim"))]
+        host_trees = [_process_tree(s["driver_pid"]) for s in host_slots if s and s.get("driver_pid")]
+        return {
+            "browsers": len(browsers),
+            "host_browsers": len(host_trees),
+            "max_concurrent": self.max_concurrent,
+            "host_processes": sum(len(tree) for tree in host_trees),
+            "host_rss_mb": round(sum(_tree_rss(tree) for tree in host_trees) / 2**20),
+            "max_rss_mb": round(self.max_rss / 2**20),
+            "recycled": recycled,
+            "reaped": reaped,
+            "per_browser": browsers,
+        }
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor():
+    """Process-wide governor configured from the environment, with its watchdog running."""
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = BrowserGovernor()
+                # Reap leftovers from earlier runs as soon as the app starts, not on the first scrape
+                _governor.start()
+    return _governor
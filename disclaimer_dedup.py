@@ -0,0 +1,422 @@
+import os
+import re
+import json
+import random
+import hashlib
+import difflib
+from html import escape
+from typing import List
+
+import tiktoken
+from bs4 import BeautifulSoup
+from pydantic import BaseModel
+
+from llm_gateway import get_gateway, PRIORITY_BATCH
+
+# Fields like "Disclaimer Breakdown 3" or "Deal Terms Analysis 3" are filled from the disclaimer templates
+BREAKDOWN_FIELD_PATTERN = re.compile(r"^(disclaimer|deal terms?)\b.*?(\d+)\s*$", re.IGNORECASE)
+
+# A text block counts as disclaimer when it is long and reads like offer fine print
+DISCLAIMER_MIN_WORDS = 20
+DISCLAIMER_HINTS = re.compile(
+    r"\b(msrp|lease|leases|lessee|tax|taxes|fees?|credit|qualify|approved|apr|financ\w*|rebate|incentive|"
+    r"residency|dealer|mileage|security deposit|stock)\b",
+    re.IGNORECASE,
+)
+BLOCK_TAGS = ["p", "div", "li", "td", "section", "article", "small"]
+
+AD_REF_FIELD = "Ad Ref"
+DISCLAIMER_PLACEHOLDER = "[[disclaimer]]"
+TEMPLATE_CACHE_PATH = os.path.join("output", "disclaimer_templates.json")
+
+# MinHash / LSH parameters: 16 bands x 4 rows puts the grouping threshold around 0.5 Jaccard,
+# candidates are then confirmed against SIMILARITY_THRESHOLD
+SHINGLE_SIZE = 4
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SIMILARITY_THRESHOLD = 0.7
+# A member that differs from the group representative more than this is treated as its own template
+MIN_ALIGNMENT_RATIO = 0.6
+MAX_SLOT_FRACTION = 0.5
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+class TemplateBreakdown(BaseModel):
+    template_id: int
+    points: List[str]
+
+
+class TemplateBreakdownsContainer(BaseModel):
+    templates: List[TemplateBreakdown]
+
+
+def find_breakdown_fields(field_names):
+    """Return the disclaimer breakdown fields in `field_names`, ordered by their number."""
+    matches = [(int(m.group(2)), name) for name in field_names if (m := BREAKDOWN_FIELD_PATTERN.match(name))]
+    return [name for _, name in sorted(matches)]
+
+
+def _looks_like_disclaimer(text):
+    return len(text.split()) >= DISCLAIMER_MIN_WORDS and len(DISCLAIMER_HINTS.findall(text)) >= 2
+
+
+def collect_disclaimers(all_ads_html):
+    """
+    Find the disclaimer text of every ad.
+    Returns (ads_html, disclaimers): each ad's HTML with an "Ad Ref" marker prepended and its disclaimer
+    blocks replaced by DISCLAIMER_PLACEHOLDER (filled in by reference_templates), and the disclaimer
+    text of each ad ("" when it has none).
+    """
+    ads_html = []
+    disclaimers = []
+    for ref, html in enumerate(all_ads_html, start=1):
+        soup = BeautifulSoup(html, "html.parser")
+        blocks = []
+        # Only leaf blocks, so a wrapper div does not pull in the non-disclaimer content next to it
+        for element in soup.find_all(BLOCK_TAGS):
+            if element.find(BLOCK_TAGS):
+                continue
+            if _looks_like_disclaimer(" ".join(element.get_text(" ").split())):
+                blocks.append(element)
+        disclaimers.append(" ".join(" ".join(block.get_text(" ").split()) for block in blocks))
+        if blocks:
+            blocks[0].string = DISCLAIMER_PLACEHOLDER
+            for block in blocks[1:]:
+                block.decompose()
+        ads_html.append(f"<p>{AD_REF_FIELD}: {ref}</p>{soup}")
+    return ads_html, disclaimers
+
+
+def _shingles(tokens):
+    # Digits are masked so variants that only differ by stock number / price shingle identically
+    normalized = [re.sub(r"\d+", "#", token.lower()) for token in tokens]
+    if len(normalized) < SHINGLE_SIZE:
+        grams = [" ".join(normalized)]
+    else:
+        grams = [" ".join(normalized[i:i + SHINGLE_SIZE]) for i in range(len(normalized) - SHINGLE_SIZE + 1)]
+    return {int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "big") for g in grams}
+
+
+def minhash_signature(tokens):
+    shingles = _shingles(tokens)
+    return [min((a * s + b) % _PRIME for s in shingles) for a, b in _PERMUTATIONS]
+
+
+def estimated_similarity(sig_a, sig_b):
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def group_near_duplicates(texts):
+    """Cluster texts whose MinHash similarity passes SIMILARITY_THRESHOLD. Returns lists of indices."""
+    signatures = [minhash_signature(text.split()) for text in texts]
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # LSH: texts sharing any band bucket become candidates
+    buckets = {}
+    for i, signature in enumerate(signatures):
+        for band in range(BANDS):
+            buckets.setdefault((band, tuple(signature[band * ROWS:(band + 1) * ROWS])), []).append(i)
+
+    for members in buckets.values():
+        for other in members[1:]:
+            first = members[0]
+            if find(first) != find(other) and estimated_similarity(signatures[first], signatures[other]) >= SIMILARITY_THRESHOLD:
+                parent[find(other)] = find(first)
+
+    groups = {}
+    for i in range(len(texts)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def _build_template(variants):
+    """
+    Align every variant against the first one and turn the token runs that differ into slots.
+    Returns (template_text, slot_values_per_variant), or None if the variants share too little.
+    """
+    rep = variants[0].split()
+    aligned = [v.split() for v in variants]
+    opcodes = [difflib.SequenceMatcher(None, rep, tokens, autojunk=False).get_opcodes() for tokens in aligned]
+
+    variable = [False] * len(rep)
+    for codes in opcodes:
+        for tag, i1, i2, _, _ in codes:
+            if tag in ("replace", "delete"):
+                variable[i1:i2] = [True] * (i2 - i1)
+            elif tag == "insert" and rep:
+                variable[min(i1, len(rep) - 1)] = True
+    if rep and sum(variable) / len(rep) > MAX_SLOT_FRACTION:
+        return None
+
+    slots = []
+    i = 0
+    while i < len(rep):
+        if variable[i]:
+            start = i
+            while i < len(rep) and variable[i]:
+                i += 1
+            slots.append((start, i))
+        else:
+            i += 1
+
+    template_tokens = []
+    previous = 0
+    for number, (start, end) in enumerate(slots, start=1):
+        template_tokens += rep[previous:start] + [f"<<{number}>>"]
+        previous = end
+    template_tokens += rep[previous:]
+
+    slot_values = []
+    for tokens, codes in zip(aligned, opcodes):
+        # Slot boundaries are tokens every variant shares, so they always map through an equal block
+        mapping = {}
+        for tag, i1, i2, j1, _ in codes:
+            if tag == "equal":
+                for offset in range(i2 - i1):
+                    mapping[i1 + offset] = j1 + offset
+        values = {}
+        for number, (start, end) in enumerate(slots, start=1):
+            left = mapping[start - 1] + 1 if start > 0 else 0
+            right = mapping[end] if end < len(rep) else len(tokens)
+            values[str(number)] = " ".join(tokens[left:right])
+        slot_values.append(values)
+
+    return " ".join(template_tokens), slot_values
+
+
+def build_templates(disclaimers):
+    """
+    Group per-ad disclaimer texts into templates with slot values.
+    Returns (templates, assignments): the template texts, and for every ad either None (no
+    disclaimer) or (template_index, slot_values).
+    """
+    unique_texts = list(dict.fromkeys(text for text in disclaimers if text))
+    templates = []
+    text_assignment = {}
+
+    def add_template(members, template, values):
+        templates.append(template)
+        for member, slot_values in zip(members, values):
+            text_assignment[member] = (len(templates) - 1, slot_values)
+
+    for group in group_near_duplicates(unique_texts):
+        members = [unique_texts[i] for i in group]
+        rep = members[0]
+        close = [m for m in members if m is rep or
+                 difflib.SequenceMatcher(None, rep.split(), m.split(), autojunk=False).ratio() >= MIN_ALIGNMENT_RATIO]
+        built = _build_template(close) if len(close) > 1 else None
+        if built:
+            add_template(close, *built)
+            singles = [m for m in members if m not in close]
+        else:
+            singles = members
+        for member in singles:
+            add_template([member], member, [{}])
+
+    assignments = [text_assignment.get(text) if text else None for text in disclaimers]
+    return templates, assignments
+
+
+def template_reference(template_index, slot_values):
+    """Stand-in for an ad's fine print in the main extraction input: its template id and slot values."""
+    reference = f"Disclaimer: T{template_index + 1}"
+    if slot_values:
+        reference += " " + "; ".join(f"<<{number}>> = {value}" for number, value in slot_values.items())
+    return reference
+
+
+def templates_section(templates, assignments):
+    """Every template used by the ads, once, with a note on how the per-ad references read."""
+    used = sorted({assignment[0] for assignment in assignments if assignment})
+    lines = ["Disclaimer templates: an ad's \"Disclaimer: T<n>\" line is template T<n> with the <<slot>> values it lists."]
+    lines += [f"T{i + 1}: {templates[i]}" for i in used]
+    return lines
+
+
+def reference_templates(ads_html, templates, assignments):
+    """
+    Replace the placeholder left by collect_disclaimers with each ad's template reference, and prepend
+    the templates themselves. The slot values keep what differs per ad (MSRP, stock number, payment...)
+    in the main input while the shared boilerplate is sent once.
+    """
+    referenced = []
+    for html, assignment in zip(ads_html, assignments):
+        if assignment:
+            html = html.replace(DISCLAIMER_PLACEHOLDER, escape(template_reference(*assignment)), 1)
+        referenced.append(html)
+    header = "".join(f"<p>{escape(line)}</p>" for line in templates_section(templates, assignments))
+    return [f"<div>{header}</div>"] + referenced
+
+
+def _template_key(template, model):
+    return hashlib.sha256(f"{model}\n{template}".encode("utf-8")).hexdigest()
+
+
+def _load_cache(cache_path):
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def dedup_pays_off(templates, assignments, model, cache_path=None):
+    """
+    True when some template is shared by several ads or already broken down in the cache. Otherwise every
+    ad would pay for its own template plus the breakdown prompt, which costs more than it saves.
+    """
+    if len(templates) < sum(1 for assignment in assignments if assignment):
+        return True
+    cache = _load_cache(cache_path or TEMPLATE_CACHE_PATH)
+    return any(_template_key(t, model) in cache for t in templates)
+
+
+def breakdown_templates(templates, model, max_points, priority=PRIORITY_BATCH, cache_path=None):
+    """
+    Break every template down into at most `max_points` points, once. Results are cached on disk by
+    template text so OEM boilerplate shared across dealers and runs is never sent twice.
+    Returns (points_per_template, prompt_text, sent) where prompt_text is what was sent ("" on a full
+    cache hit) and sent lists the indices of the templates that were not cached.
+    """
+    cache_path = cache_path or TEMPLATE_CACHE_PATH
+    cache = _load_cache(cache_path)
+
+    missing = [i for i, t in enumerate(templates) if _template_key(t, model) not in cache]
+    prompt_text = ""
+    if missing:
+        system_message = f"""You are an expert at analysing car dealer offer disclaimers and deal terms.
+                        For every numbered disclaimer template, break the text down into at most {max_points} separate points,
+                        one piece of information per point, in the order it appears. Merge related information if there would be more points.
+                        Placeholders such as <<1>> stand for values that differ between ads: keep them verbatim in the point they belong to and never guess their value.
+                        Return one entry per template with its template_id."""
+        user_message = "\n\n".join(f"Template {i}:\n{templates[i]}" for i in missing)
+        prompt_text = system_message + user_message
+
+        completion = get_gateway().parse(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": user_message},
+            ],
+            response_format=TemplateBreakdownsContainer,
+            priority=priority,
+        )
+        for breakdown in completion.choices[0].message.parsed.templates:
+            if 0 <= breakdown.template_id < len(templates):
+                cache[_template_key(templates[breakdown.template_id], model)] = breakdown.points
+
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=4)
+
+    return [cache.get(_template_key(t, model), []) for t in templates], prompt_text, missing
+
+
+def fill_breakdown_fields(points, slot_values, breakdown_fields):
+    """Substitute the ad's slot values into the template points and spread them over the breakdown fields."""
+    filled = []
+    for point in points:
+        for number, value in slot_values.items():
+            point = point.replace(f"<<{number}>>", value)
+        filled.append(point)
+    if len(filled) > len(breakdown_fields):
+        # Keep everything: overflow goes into the last field
+        filled = filled[:len(breakdown_fields) - 1] + [" ".join(filled[len(breakdown_fields) - 1:])]
+    filled += [""] * (len(breakdown_fields) - len(filled))
+    return dict(zip(breakdown_fields, filled))
+
+
+def _ad_ref(value):
+    match = re.search(r"\d+", str(value or ""))
+    return int(match.group()) if match else None
+
+
+def apply_disclaimer_breakdowns(listings, disclaimers, breakdown_fields, model, priority=PRIORITY_BATCH, cache_path=None,
+                                built=None):
+    """
+    Fill `breakdown_fields` on every listing dict (matched to its ad through the "Ad Ref" field) from
+    the deduplicated disclaimer templates. `built` is the (templates, assignments) pair from
+    build_templates when the main input already carried the template references.
+    Returns (listings, report, prompt_text, output_text), the last two being what was sent to and
+    generated by the breakdown call ("" on a full cache hit).
+    """
+    templates, assignments = built or build_templates(disclaimers)
+    points, prompt_text, sent = breakdown_templates(templates, model, len(breakdown_fields), priority, cache_path)
+    output_text = "\n".join(point for i in sent for point in points[i])
+
+    merged = []
+    for listing in listings:
+        listing = dict(listing)
+        ref = _ad_ref(listing.pop(AD_REF_FIELD, None))
+        assignment = assignments[ref - 1] if ref and ref <= len(assignments) else None
+        if assignment:
+            template_index, slot_values = assignment
+            listing.update(fill_breakdown_fields(points[template_index], slot_values, breakdown_fields))
+        else:
+            listing.update({field: "" for field in breakdown_fields})
+        merged.append(listing)
+
+    # Without a main extraction call (API listings) no references were sent
+    reference_texts = []
+    if built:
+        reference_texts = templates_section(templates, assignments)
+        reference_texts += [template_reference(*assignment) for assignment in assignments if assignment]
+    report = dedup_report(disclaimers, templates, sent, prompt_text, output_text, reference_texts,
+                          merged, breakdown_fields, model)
+    return merged, report, prompt_text, output_text
+
+
+def dedup_report(disclaimers, templates, sent, prompt_text, output_text, reference_texts, listings, breakdown_fields, model):
+    """
+    Dedup statistics for one run. Without dedup every ad's fine print is read and its breakdown written
+    out per ad; with it the input carries the template references instead, and each uncached template
+    is broken down once at the cost of the breakdown prompt.
+    """
+    try:
+        encoder = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoder = tiktoken.get_encoding("o200k_base")
+
+    def count(texts):
+        return sum(len(encoder.encode(text)) for text in texts if text)
+
+    with_disclaimer = [text for text in disclaimers if text]
+    disclaimer_tokens = count(with_disclaimer)
+    reference_tokens = count(reference_texts)
+    per_ad_tokens = count(listing[field] for listing in listings for field in breakdown_fields)
+    output_tokens = count([output_text])
+    input_tokens = count([prompt_text])
+    return {
+        "ads": len(disclaimers),
+        "ads_with_disclaimer": len(with_disclaimer),
+        "unique_variants": len(set(with_disclaimer)),
+        "templates": len(templates),
+        "templates_from_cache": len(templates) - len(sent),
+        "dedup_ratio": round(1 - len(templates) / len(with_disclaimer), 4) if with_disclaimer else 0.0,
+        "disclaimer_input_tokens": disclaimer_tokens,
+        "reference_input_tokens": reference_tokens,
+        "per_ad_breakdown_tokens": per_ad_tokens,
+        "breakdown_output_tokens": output_tokens,
+        "breakdown_input_tokens": input_tokens,
+        # Negative on a cold cache when too few ads share a template to pay for the breakdown prompt
+        "tokens_avoided": disclaimer_tokens + per_ad_tokens - reference_tokens - output_tokens - input_tokens,
+    }
+
+
+def save_dedup_report(report, timestamp, output_folder='output'):
+    os.makedirs(output_folder, exist_ok=True)
+    report_path = os.path.join(output_folder, f'disclaimer_report_{timestamp}.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    print(f"Disclaimer dedup: {report['ads_with_disclaimer']} disclaimers -> {report['templates']} templates, "
+          f"{report['tokens_avoided']} tokens avoided ({report_path})")
+    return report_path
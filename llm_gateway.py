@@ -0,0 +1,291 @@
+import os
+import time
+import random
+import threading
+import heapq
+import itertools
+from email.utils import parsedate_to_datetime
+
+import tiktoken
+from dotenv import load_dotenv
+from openai import OpenAI, APIStatusError, APIConnectionError
+
+load_dotenv()
+
+# Priority lanes: lower value is admitted first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# Status codes worth retrying (rate limited, overloaded or transient server errors)
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `limit_per_minute / 60` per second.
+    The capacity is one minute worth of budget, so a cold start can burst up to the limit.
+    """
+
+    def __init__(self, limit_per_minute):
+        self.capacity = float(limit_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` tokens are available (0 if they are available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)  # Oversized requests only need a full bucket
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class LLMGateway:
+    """
+    Process-wide gateway in front of the OpenAI API.
+
+    Every call goes through a single pooled client and is admitted against
+    requests-per-minute and tokens-per-minute buckets. Waiting requests are served
+    in priority order (interactive before batch, FIFO within a lane). Rate limit and
+    transient errors are retried with jittered exponential backoff, honoring
+    `Retry-After` when the server sends it.
+    """
+
+    def __init__(self, api_key=None, base_url=None, rpm_limit=None, tpm_limit=None,
+                 max_retries=None, max_output_tokens=None, backoff_base=None, backoff_max=None,
+                 client=None):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL") or None
+        self.max_retries = max_retries if max_retries is not None else _env_int("LLM_MAX_RETRIES", 6)
+        self.max_output_tokens = max_output_tokens or _env_int("LLM_MAX_OUTPUT_TOKENS", 16000)
+        self.backoff_base = backoff_base if backoff_base is not None else _env_float("LLM_BACKOFF_BASE", 1.0)
+        self.backoff_max = backoff_max if backoff_max is not None else _env_float("LLM_BACKOFF_MAX", 60.0)
+
+        self.request_bucket = TokenBucket(rpm_limit or _env_int("LLM_RPM_LIMIT", 500))
+        self.token_bucket = TokenBucket(tpm_limit or _env_int("LLM_TPM_LIMIT", 200000))
+
+        self._client = client
+        self._client_lock = threading.Lock()
+
+        # Admission queue: heap of (priority, sequence) tickets guarded by a condition
+        self._cond = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._blocked_until = 0.0  # Set when the server tells us to back off
+
+        self._metrics = {
+            "requests": 0,
+            "completed": 0,
+            "failed": 0,
+            "retries": 0,
+            "admitted": 0,
+            "rate_limited": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "queue_depth_max": 0,
+            "tokens_reserved": 0,
+            "tokens_used": 0,
+        }
+
+    @property
+    def client(self):
+        # Lazily build one client per process; its HTTP connection pool is shared by all calls
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    if not self.api_key:
+                        raise RuntimeError("OPENAI_API_KEY is not set (add it to the environment or .env)")
+                    # Retries are handled here so they can respect our buckets, not by the SDK
+                    self._client = OpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        return self._client
+
+    def estimate_tokens(self, messages, model):
+        try:
+            encoder = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoder = tiktoken.get_encoding("o200k_base")
+        # Roughly 4 tokens of framing per message on top of its content
+        return sum(len(encoder.encode(m["content"])) + 4 for m in messages)
+
+    def _acquire(self, cost, priority):
+        ticket = (priority, next(self._sequence))
+        enqueued = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            self._metrics["queue_depth_max"] = max(self._metrics["queue_depth_max"], len(self._queue))
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._queue[0] == ticket:
+                        delay = max(
+                            self._blocked_until - now,
+                            self.request_bucket.wait_time(1, now),
+                            self.token_bucket.wait_time(cost, now),
+                        )
+                        if delay <= 0:
+                            self.request_bucket.take(1)
+                            self.token_bucket.take(cost)
+                            break
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+            waited = time.monotonic() - enqueued
+            self._metrics["admitted"] += 1
+            self._metrics["wait_time_total"] += waited
+            self._metrics["wait_time_max"] = max(self._metrics["wait_time_max"], waited)
+            self._metrics["tokens_reserved"] += cost
+
+    def _settle(self, reserved, used):
+        # Return the unused part of the reservation once the real usage is known
+        with self._cond:
+            if used is not None and used < reserved:
+                self.token_bucket.give_back(reserved - used)
+            self._metrics["tokens_used"] += used if used is not None else reserved
+            self._cond.notify_all()
+
+    def _block_for(self, seconds):
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def _retry_after(self, error):
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        headers = response.headers
+        if headers.get("retry-after-ms"):
+            try:
+                return float(headers["retry-after-ms"]) / 1000.0
+            except ValueError:
+                pass
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP-date form
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+
+    def _backoff(self, attempt):
+        # Full jitter: uniform over [0, min(max, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def parse(self, model, messages, response_format, priority=PRIORITY_BATCH, max_output_tokens=None):
+        """
+        Structured-output chat completion (`client.beta.chat.completions.parse`) through the gateway.
+        Returns the raw completion object.
+        """
+        max_output_tokens = max_output_tokens or self.max_output_tokens
+        cost = self.estimate_tokens(messages, model) + max_output_tokens
+
+        with self._cond:
+            self._metrics["requests"] += 1
+
+        attempt = 0
+        while True:
+            self._acquire(cost, priority)
+            try:
+                completion = self.client.beta.chat.completions.parse(
+                    model=model,
+                    messages=messages,
+                    response_format=response_format,
+                    max_tokens=max_output_tokens,
+                )
+            except (APIStatusError, APIConnectionError) as e:
+                status = getattr(e, "status_code", None)
+                retryable = isinstance(e, APIConnectionError) or status in RETRYABLE_STATUS
+                # A rejected request did not consume tokens on the server side
+                self._settle(cost, 0)
+                if not retryable or attempt >= self.max_retries:
+                    with self._cond:
+                        self._metrics["failed"] += 1
+                    raise
+
+                delay = self._retry_after(e)
+                if status == 429:
+                    with self._cond:
+                        self._metrics["rate_limited"] += 1
+                    if delay is not None:
+                        # Everybody waits, not just this caller
+                        self._block_for(delay)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                else:
+                    delay += random.uniform(0, self.backoff_base)
+
+                attempt += 1
+                with self._cond:
+                    self._metrics["retries"] += 1
+                print(f"LLM request failed ({status or type(e).__name__}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            except Exception as e:
+                # Not retryable: no API key, output cut off at max_tokens, unparseable structured output...
+                # Settle with the usage the SDK attached to the completion, if any, so the reservation is not lost
+                usage = getattr(getattr(e, "completion", None), "usage", None)
+                self._settle(cost, getattr(usage, "total_tokens", None) or 0)
+                with self._cond:
+                    self._metrics["failed"] += 1
+                raise
+
+            usage = getattr(completion, "usage", None)
+            self._settle(cost, getattr(usage, "total_tokens", None))
+            with self._cond:
+                self._metrics["completed"] += 1
+            return completion
+
+    def metrics(self):
+        """Snapshot of queue depth, wait time and retry counters."""
+        with self._cond:
+            snapshot = dict(self._metrics)
+            snapshot["queue_depth"] = len(self._queue)
+            snapshot["queue_depth_interactive"] = sum(1 for p, _ in self._queue if p == PRIORITY_INTERACTIVE)
+            snapshot["queue_depth_batch"] = snapshot["queue_depth"] - snapshot["queue_depth_interactive"]
+            admitted = snapshot["admitted"]
+            snapshot["wait_time_avg"] = snapshot["wait_time_total"] / admitted if admitted else 0.0
+            snapshot["rpm_available"] = int(self.request_bucket.tokens)
+            snapshot["tpm_available"] = int(self.token_bucket.tokens)
+        return snapshot
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Return the process-wide gateway, creating it from the environment on first use."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
@@ -0,0 +1,149 @@
+"""
+Capture the JSON (XHR/fetch) responses a page loads and turn them into listings.
+
+Dealer-platform specials pages render their offers from JSON APIs. With Chrome performance
+logging enabled (`setup_selenium(capture_network=True)`) the responses are read back through
+the DevTools protocol, and a per-site "api" mapping in url_tag_mapping.json builds listings
+straight from the JSON, skipping modal clicks, markdown conversion and the extraction LLM call:
+
+    "api": {
+        "url_pattern": "regex matched against the response URL",
+        "records": "dotted.path.to.offer.list",   ("*" walks every list item / dict value)
+        "fields": {"Car Name": ["year", "make", "model"], "MSRP": "pricing.msrp"},
+        "disclaimer": "disclaimer"                  (free text, broken down by the LLM)
+    }
+
+Every capture is saved to output/network_capture_<timestamp>.json so a mapping can be written
+from what the site actually returns.
+"""
+import os
+import re
+import json
+import time
+import base64
+
+from bs4 import BeautifulSoup
+from selenium.common.exceptions import WebDriverException
+
+
+def enable_network_capture(options):
+    """Turn on Chrome performance logging (network events) for a driver built from `options`."""
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+
+def capture_json_responses(driver, settle_time=2):
+    """
+    Return every XHR/fetch JSON response seen since the last call as {"url", "status", "data"}.
+    Scrolls to the bottom first so lazily loaded offers are requested too.
+    """
+    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+    time.sleep(settle_time)  # Let in-flight requests finish
+
+    responses = []
+    seen = set()
+    for entry in driver.get_log("performance"):
+        message = json.loads(entry["message"])["message"]
+        if message.get("method") != "Network.responseReceived":
+            continue
+        params = message["params"]
+        response = params["response"]
+        if params.get("type") not in ("XHR", "Fetch") or "json" not in response.get("mimeType", ""):
+            continue
+        if params["requestId"] in seen:
+            continue
+        seen.add(params["requestId"])
+
+        try:
+            body = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": params["requestId"]})
+        except WebDriverException:
+            # Body already evicted or the request never finished
+            continue
+        text = base64.b64decode(body["body"]).decode("utf-8", "replace") if body.get("base64Encoded") else body["body"]
+        try:
+            data = json.loads(text)
+        except ValueError:
+            continue
+        responses.append({"url": response["url"], "status": response.get("status"), "data": data})
+
+    print(f"Captured {len(responses)} JSON responses")
+    return responses
+
+
+def save_captured_responses(responses, timestamp, output_folder='output'):
+    os.makedirs(output_folder, exist_ok=True)
+    capture_path = os.path.join(output_folder, f'network_capture_{timestamp}.json')
+    with open(capture_path, 'w', encoding='utf-8') as f:
+        json.dump(responses, f, indent=4)
+    print(f"Network capture saved to {capture_path}")
+    return capture_path
+
+
+def _walk(value, segments):
+    if not segments:
+        yield value
+        return
+    head, rest = segments[0], segments[1:]
+    if head == "*":
+        children = value if isinstance(value, list) else list(value.values()) if isinstance(value, dict) else []
+        for child in children:
+            yield from _walk(child, rest)
+    elif isinstance(value, dict) and head in value:
+        yield from _walk(value[head], rest)
+    elif isinstance(value, list) and head.isdigit() and int(head) < len(value):
+        yield from _walk(value[int(head)], rest)
+
+
+def resolve_path(data, path):
+    """All values at a dotted `path` ("" is the data itself)."""
+    return list(_walk(data, [s for s in path.split(".") if s]))
+
+
+def _to_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ", ".join(t for t in (_to_text(v) for v in value) if t)
+    if isinstance(value, dict):
+        return json.dumps(value)
+    text = str(value)
+    # Some APIs return fine print as HTML
+    if "<" in text and ">" in text:
+        text = BeautifulSoup(text, "html.parser").get_text(" ")
+    return " ".join(text.split())
+
+
+def _mapped_value(record, spec):
+    paths = spec if isinstance(spec, list) else [spec]
+    return " ".join(t for t in (_to_text(v) for path in paths for v in resolve_path(record, path)) if t)
+
+
+def listings_from_responses(responses, mapping):
+    """
+    Build listing dicts (mapped fields only) and per-listing disclaimer text from the captured
+    responses that match `mapping`. Records repeated across responses are kept once.
+    """
+    pattern = re.compile(mapping["url_pattern"])
+    records = []
+    seen = set()
+    for response in responses:
+        if not pattern.search(response["url"]):
+            continue
+        for found in resolve_path(response["data"], mapping.get("records", "")):
+            for record in (found if isinstance(found, list) else [found]):
+                if not isinstance(record, dict):
+                    continue
+                key = json.dumps(record, sort_keys=True)
+                if key not in seen:
+                    seen.add(key)
+                    records.append(record)
+
+    listings = [{field: _mapped_value(record, spec) for field, spec in mapping.get("fields", {}).items()}
+                for record in records]
+    disclaimers = [_mapped_value(record, mapping["disclaimer"]) if mapping.get("disclaimer") else ""
+                   for record in records]
+    return listings, disclaimers
+
+
+def select_fields(listings, fields):
+    """Listing dicts holding exactly `fields`, in that order ("" where nothing was mapped)."""
+    return [{field: listing.get(field, "") for field in fields} for listing in listings]
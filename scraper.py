@@ -17,7 +17,6 @@ import html2text
 import tiktoken
 
 from dotenv import load_dotenv
-from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
@@ -25,7 +24,9 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import chromedriver_autoinstaller
 
-from openai import OpenAI
+from llm_gateway import get_gateway, PRIORITY_BATCH
+from network_capture import enable_network_capture
+from browser_governor import get_governor
 
 load_dotenv()
 
@@ -45,7 +46,7 @@ def install_chrome():
         subprocess.run(["sudo", "apt", "install", "-y", chrome_deb_path], check=True)
     else:
         raise Exception("Failed to download Google Chrome.")
-def setup_selenium():
+def setup_selenium(capture_network=False):
     try:
         # Try to get the Chrome version (this checks if Chrome is installed)
         subprocess.run(["google-chrome", "--version"], check=True)
@@ -64,8 +65,13 @@ def setup_selenium():
     options.add_argument("--disable-dev-shm-usage")  # Overcome limited resource problems
     options.add_argument("--window-size=1920,1080")
 
-    # Initialize the WebDriver
-    driver = webdriver.Chrome(options=options)
+    # Record network events so XHR/fetch JSON responses can be read back (see network_capture.py)
+    if capture_network:
+        enable_network_capture(options)
+
+    # Initialize the WebDriver through the governor, which caps concurrent browsers and
+    # recycles any that exceed their memory or time limit
+    driver = get_governor().launch(options)
     
     return driver
 
@@ -187,18 +193,7 @@ def trim_to_token_limit(text, model, max_tokens=200000):
         return trimmed_text
     return text
 
-def format_data(data, DynamicListingsContainer):
-        
-    key_part1 = 'sk'
-    key_part2 = '-proj'
-    key_part3 = '-2fH0WLrBvNRD7ag_Fj_mgCl5'
-    key_part4 = 'cMojsQxgGcBFAim_0H6RhaLsGGtngsIsTWM7wxpON-uCb'
-    key_part5 = 'kzMcdT3BlbkFJT4rIOY7IFor7ny_rlxjU72zzXIJ7yNzQ8xYJDgqX14FwetocemuZY1MMegRfczc5Y0l88Ddw4A'
-
-    full_key = key_part1 + key_part2 + key_part3 + key_part4 + key_part5
-
-
-    client = OpenAI(api_key=full_key)
+def format_data(data, DynamicListingsContainer, model=model_used, priority=PRIORITY_BATCH):
 
     system_message = """You are an intelligent text extraction and conversion assistant. Your task is to extract structured information 
                         from the given text and convert it into a pure JSON format. The JSON should contain only the structured data extracted from the text, 
@@ -209,13 +204,15 @@ def format_data(data, DynamicListingsContainer):
 
     user_message = f"Extract the following information from the provided text and make points if there is disclaimer:\nPage content:\n\n{data}"
 
-    completion = client.beta.chat.completions.parse(
-        model=model_used,
+    # All LLM traffic goes through the shared, rate-limit-aware gateway
+    completion = get_gateway().parse(
+        model=model,
         messages=[
             {"role": "system", "content": system_message},
             {"role": "user", "content": user_message},
         ],
-        response_format=DynamicListingsContainer
+        response_format=DynamicListingsContainer,
+        priority=priority,
     )
     return completion.choices[0].message.parsed
     
@@ -0,0 +1,289 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+import threading
+import uuid
+import weakref
+from datetime import datetime, timedelta
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp{uuid.uuid4().hex}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class SnapshotStore:
+    """
+    Compressed, content-addressed store for fetched HTML.
+
+    Layout under `root`:
+        blobs/ab/<sha256>.html.gz   one gzip file per distinct page/ad/modal body
+        index.json                  latest snapshot per key (URL, or URL#ad:/#detail:<hash>)
+        runs/<run_id>.json          ordered list of ads captured by one scrape, used for replay
+
+    Identical content is stored once no matter how many runs or keys point at it.
+    """
+
+    def __init__(self, root=None, retention_days=None, max_runs=None, detail_max_age_hours=None):
+        self.root = root or os.getenv("SNAPSHOT_DIR", "snapshots")
+        self.retention_days = retention_days if retention_days is not None else int(os.getenv("SNAPSHOT_RETENTION_DAYS", "30"))
+        self.max_runs = max_runs if max_runs is not None else int(os.getenv("SNAPSHOT_MAX_RUNS", "20"))
+        self.detail_max_age_hours = (detail_max_age_hours if detail_max_age_hours is not None
+                                     else float(os.getenv("SNAPSHOT_DETAIL_MAX_AGE_HOURS", "24")))
+
+        self.blob_dir = os.path.join(self.root, "blobs")
+        self.run_dir = os.path.join(self.root, "runs")
+        self.index_path = os.path.join(self.root, "index.json")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.run_dir, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._index = self._load_index()
+        # Runs still being captured: their blobs are not in any run file yet but must survive prune()
+        self._open_runs = weakref.WeakSet()
+
+    # Blobs
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], f"{digest}.html.gz")
+
+    def put(self, content):
+        """Store `content` and return its hash. Content already in the store is not written again."""
+        digest = content_hash(content)
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # One temp file per write: sessions are threads of one process and often store the same ad
+            tmp_path = f"{path}.tmp{uuid.uuid4().hex}"
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                f.write(content)
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                # Lost the race to another writer of the same content, which is just as good
+                if not os.path.exists(path):
+                    raise
+                os.remove(tmp_path)
+        return digest
+
+    def get(self, digest):
+        with gzip.open(self._blob_path(digest), "rt", encoding="utf-8") as f:
+            return f.read()
+
+    # Index
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    def flush(self):
+        with self._lock:
+            _write_json_atomic(self.index_path, self._index)
+
+    def latest(self, key):
+        with self._lock:
+            return self._index.get(key)
+
+    def record(self, key, content, **meta):
+        """Store `content` as the latest snapshot for `key` and return its hash."""
+        entry = {"fetched_at": datetime.now().isoformat(timespec="seconds")}
+        entry.update({k: v for k, v in meta.items() if v})
+        # Held across put() so prune() cannot see the blob before the entry referencing it
+        with self._lock:
+            entry["hash"] = digest = self.put(content)
+            self._index[key] = entry
+        return digest
+
+    @staticmethod
+    def ad_key(url, ad_html):
+        return f"{url}#ad:{content_hash(ad_html)[:16]}"
+
+    @staticmethod
+    def detail_key(url, ad_html):
+        return f"{url}#detail:{content_hash(ad_html)[:16]}"
+
+    # Conditional re-fetch
+
+    def fetch_http(self, url, session=None, timeout=30):
+        """
+        GET `url`, sending If-None-Match / If-Modified-Since from the last snapshot.
+        Returns (html, changed); on 304 the stored snapshot is returned with changed=False.
+        """
+        previous = self.latest(url)
+        headers = {}
+        if previous:
+            if previous.get("etag"):
+                headers["If-None-Match"] = previous["etag"]
+            if previous.get("last_modified"):
+                headers["If-Modified-Since"] = previous["last_modified"]
+
+        response = (session or requests).get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and previous:
+            print(f"Not modified since {previous['fetched_at']}, using snapshot of {url}")
+            return self.get(previous["hash"]), False
+        response.raise_for_status()
+
+        html = response.text
+        digest = self.record(url, html, etag=response.headers.get("ETag"),
+                             last_modified=response.headers.get("Last-Modified"))
+        self.flush()
+        return html, not previous or previous["hash"] != digest
+
+    def detail_for(self, url, ad_html):
+        """
+        Browser-path equivalent of a conditional GET: if this exact ad (by content hash) was
+        captured recently, return the detail/modal HTML stored with it instead of re-opening it.
+        """
+        entry = self.latest(self.detail_key(url, ad_html))
+        if not entry:
+            return None
+        age = datetime.now() - datetime.fromisoformat(entry["fetched_at"])
+        if age > timedelta(hours=self.detail_max_age_hours):
+            return None
+        try:
+            return self.get(entry["hash"])
+        except FileNotFoundError:
+            return None
+
+    # Runs and replay
+
+    def start_run(self, site, url, timestamp):
+        return SnapshotRun(self, site, url, timestamp)
+
+    def list_runs(self, site=None):
+        """Metadata for stored runs, newest first."""
+        runs = []
+        for name in os.listdir(self.run_dir):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(self.run_dir, name), "r", encoding="utf-8") as f:
+                run = json.load(f)
+            if site is None or run["site"] == site:
+                runs.append({k: run[k] for k in ("run_id", "site", "url", "created_at")} | {"ads": len(run["items"])})
+        return sorted(runs, key=lambda r: (r["created_at"], r["run_id"]), reverse=True)
+
+    def load_run(self, run_id):
+        """Return the HTML of every ad (ad + detail parts joined) captured by a run, in order."""
+        with open(os.path.join(self.run_dir, f"{run_id}.json"), "r", encoding="utf-8") as f:
+            run = json.load(f)
+        return ["".join(self.get(digest) for digest in item["parts"]) for item in run["items"]]
+
+    # Retention
+
+    def prune(self):
+        """
+        Drop runs past the retention window or beyond `max_runs` per site, expire old index
+        entries, then delete blobs no longer referenced by any run or index entry.
+        """
+        with self._lock:
+            now = datetime.now()
+            cutoff = now - timedelta(days=self.retention_days) if self.retention_days > 0 else None
+
+            runs_by_site = {}
+            for run in self.list_runs():
+                runs_by_site.setdefault(run["site"], []).append(run)
+
+            referenced = set()
+            for site_runs in runs_by_site.values():
+                for position, run in enumerate(site_runs):
+                    expired = cutoff and datetime.fromisoformat(run["created_at"]) < cutoff
+                    if expired or (self.max_runs > 0 and position >= self.max_runs):
+                        os.remove(os.path.join(self.run_dir, f"{run['run_id']}.json"))
+                        continue
+                    with open(os.path.join(self.run_dir, f"{run['run_id']}.json"), "r", encoding="utf-8") as f:
+                        for item in json.load(f)["items"]:
+                            referenced.update(item["parts"])
+            for open_run in list(self._open_runs):
+                for item in open_run.items:
+                    referenced.update(item["parts"])
+
+            if cutoff:
+                self._index = {key: entry for key, entry in self._index.items()
+                               if datetime.fromisoformat(entry["fetched_at"]) >= cutoff}
+            referenced.update(entry["hash"] for entry in self._index.values())
+            self.flush()
+
+            removed = 0
+            for prefix in os.listdir(self.blob_dir):
+                prefix_dir = os.path.join(self.blob_dir, prefix)
+                for name in os.listdir(prefix_dir):
+                    # Temp files belong to writes still in progress
+                    if ".tmp" in name:
+                        continue
+                    if name.split(".", 1)[0] not in referenced:
+                        os.remove(os.path.join(prefix_dir, name))
+                        removed += 1
+            if removed:
+                print(f"Pruned {removed} unreferenced snapshots from {self.root}")
+
+
+class SnapshotRun:
+    """Ordered record of the pages/ads captured by one scrape."""
+
+    def __init__(self, store, site, url, timestamp):
+        self.store = store
+        self.site = site or "custom"
+        self.url = url
+        self.run_id = re.sub(r"[^A-Za-z0-9_-]+", "-", f"{self.site}_{timestamp}")
+        self.created_at = datetime.now().isoformat(timespec="seconds")
+        self.items = []
+        store._open_runs.add(self)
+
+    def add_page(self, html):
+        # Only reference the blob: the URL's index entry belongs to fetch_http and holds its validators.
+        # The store lock keeps prune() out until the blob is listed in self.items
+        with self.store._lock:
+            digest = self.store.put(html)
+            self.items.append({"key": self.url, "parts": [digest]})
+
+    def add_ad(self, ad_html, detail_html=None, detail_reused=False):
+        key = self.store.ad_key(self.url, ad_html)
+        with self.store._lock:
+            parts = [self.store.record(key, ad_html)]
+            if detail_html is not None:
+                if detail_reused:
+                    # Keep the original capture time so reuse cannot extend a snapshot's age forever
+                    parts.append(self.store.put(detail_html))
+                else:
+                    parts.append(self.store.record(self.store.detail_key(self.url, ad_html), detail_html))
+            self.items.append({"key": key, "parts": parts})
+
+    def save(self):
+        _write_json_atomic(os.path.join(self.store.run_dir, f"{self.run_id}.json"), {
+            "run_id": self.run_id,
+            "site": self.site,
+            "url": self.url,
+            "created_at": self.created_at,
+            "items": self.items,
+        })
+        self.store._open_runs.discard(self)
+        self.store.flush()
+        self.store.prune()
+        print(f"Snapshot run saved as {self.run_id} ({len(self.items)} items)")
+        return self.run_id
+
+
+_store = None
+
+
+def get_snapshot_store():
+    """Process-wide snapshot store configured from the environment."""
+    global _store
+    if _store is None:
+        _store = SnapshotStore()
+    return _store
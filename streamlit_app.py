@@ -5,6 +5,11 @@ import pandas as pd
 import json
 from datetime import datetime
 from scraper import fetch_html_selenium, save_raw_data, format_data, save_formatted_data, calculate_price, html_to_markdown_with_readability, create_dynamic_listing_model, create_listings_container_model,setup_selenium
+from llm_gateway import get_gateway, PRIORITY_INTERACTIVE
+from snapshot_store import get_snapshot_store
+from browser_governor import get_governor
+from network_capture import capture_json_responses, save_captured_responses, listings_from_responses, select_fields
+from disclaimer_dedup import find_breakdown_fields, collect_disclaimers, build_templates, dedup_pays_off, reference_templates, apply_disclaimer_breakdowns, save_dedup_report, AD_REF_FIELD
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -94,142 +99,211 @@ else:
 # Process tags into a list
 fields = tags
 
+# Snapshot store for fetched HTML; replay re-runs extraction from a stored run without re-scraping
+snapshot_store = get_snapshot_store()
+fetch_method = "Browser"
+if selected_url_key == "Custom URL":
+    fetch_method = st.sidebar.radio("Fetch Method", options=["Browser", "HTTP"], index=0)
+
+replay_run_id = None
+if st.sidebar.checkbox("Replay from snapshot"):
+    snapshot_runs = snapshot_store.list_runs(site=selected_url_key or None)
+    run_labels = {f"{r['run_id']} ({r['ads']} items)": r["run_id"] for r in snapshot_runs}
+    if run_labels:
+        replay_run_id = run_labels[st.sidebar.selectbox("Snapshot Run", options=list(run_labels))]
+    else:
+        st.sidebar.info("No snapshots stored for this website yet.")
+
+# Dealer-platform sites can be read from the JSON their pages load instead of the rendered HTML
+api_mapping = url_tags_mapping.get(selected_url_key, {}).get("api")
+capture_network = api_mapping is not None
+if selected_url_key in ("Cecconi", "Northtown") and not api_mapping:
+    capture_network = st.sidebar.checkbox("Record JSON API responses", help="Saves the page's XHR/fetch JSON to output/ for writing an API mapping")
+
 # Initialize variables to store token and cost information
 input_tokens = output_tokens = total_cost = 0  # Default values
 
-# Define the scraping function
-def perform_scrape():
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    raw_html = fetch_html_selenium(url_input)
-    markdown = html_to_markdown_with_readability(raw_html)
-    save_raw_data(markdown, timestamp)
-    DynamicListingModel = create_dynamic_listing_model(fields)
+# Shared tail of every scrape: convert the captured ads to markdown and extract the fields
+def extract_listings(all_ads_html, timestamp):
+    # Disclaimer breakdown fields are filled from deduplicated templates instead of per ad by the main call.
+    # The main input carries every template once and, per ad, its template id and slot values: those hold
+    # what differs between ads (MSRP, stock number, payment...), so fields stated only in the fine print survive
+    breakdown_fields = find_breakdown_fields(fields)
+    listing_fields = fields
+    built = None
+    if breakdown_fields:
+        marked_ads_html, disclaimers = collect_disclaimers(all_ads_html)
+        built = build_templates(disclaimers)
+        if any(disclaimers) and dedup_pays_off(*built, model_selection):
+            all_ads_html = reference_templates(marked_ads_html, *built)
+            listing_fields = [f for f in fields if f not in breakdown_fields] + [AD_REF_FIELD]
+        else:
+            # No fine print, or nothing repeats and nothing is cached: let the main call break it down as before
+            breakdown_fields = []
+
+    # Combine all ads' HTML content into a single block
+    all_ads_content = "\n".join(all_ads_html)
+
+    # Convert the ads' HTML content to Markdown
+    ads_markdown = html_to_markdown_with_readability(all_ads_content)
+
+    # Save the markdown content for future use (the source HTML lives in the snapshot store)
+    save_raw_data(ads_markdown, timestamp)
+
+    # Use dynamic models and process as needed
+    DynamicListingModel = create_dynamic_listing_model(listing_fields)
     DynamicListingsContainer = create_listings_container_model(DynamicListingModel)
-    formatted_data = format_data(markdown, DynamicListingsContainer)
-    formatted_data_text = json.dumps(formatted_data.dict())
-    input_tokens, output_tokens, total_cost = calculate_price(markdown, formatted_data_text, model=model_selection)
+    formatted_data = format_data(ads_markdown, DynamicListingsContainer, model=model_selection, priority=PRIORITY_INTERACTIVE)
+
+    # Price what the LLM actually read and generated; cached breakdowns cost nothing
+    input_text = ads_markdown
+    output_text = json.dumps(formatted_data.dict())
+    dedup_report = None
+    if breakdown_fields:
+        listings, dedup_report, breakdown_prompt, breakdown_output = apply_disclaimer_breakdowns(
+            [listing.dict() for listing in formatted_data.listings], disclaimers, breakdown_fields,
+            model=model_selection, priority=PRIORITY_INTERACTIVE, built=built)
+        save_dedup_report(dedup_report, timestamp)
+        input_text += breakdown_prompt
+        output_text += breakdown_output
+
+        # Rebuild the result with the full field list in the user's order
+        DynamicListingsContainer = create_listings_container_model(create_dynamic_listing_model(fields))
+        formatted_data = DynamicListingsContainer(listings=[{f: listing.get(f, "") for f in fields} for listing in listings])
+    st.session_state['dedup_report'] = dedup_report
+
+    input_tokens, output_tokens, total_cost = calculate_price(input_text, output_text, model=model_selection)
     df = save_formatted_data(formatted_data, timestamp)
 
-    return df, formatted_data, markdown, input_tokens, output_tokens, total_cost, timestamp
+    return df, formatted_data, ads_markdown, input_tokens, output_tokens, total_cost, timestamp
 
 
-def perform_scrape_cecconi():
-    driver = setup_selenium()
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-
-    try:
-        # Open the Cecconi page
-        driver.get(url_input)
-        time.sleep(3)  # Give time for the page to load
+# Listings built straight from captured API JSON; only the disclaimer breakdown goes to the LLM
+def extract_listings_from_api(listings, disclaimers, source_text, timestamp):
+    save_raw_data(source_text, timestamp)
 
-        # Find all the ads (divs) with the class 'promo promo-type-vehicle' and 'promo promo-type-incentive'
-        ads = driver.find_elements(By.CSS_SELECTOR, ".promo.promo-type-vehicle, .promo.promo-type-incentive")
+    breakdown_fields = find_breakdown_fields(fields)
+    # The listings come from JSON, not from the LLM: only the breakdown call (when not fully cached) is priced
+    input_text = output_text = ""
+    dedup_report = None
+    if breakdown_fields:
+        listings = [dict(listing, **{AD_REF_FIELD: str(ref)}) for ref, listing in enumerate(listings, start=1)]
+        listings, dedup_report, input_text, output_text = apply_disclaimer_breakdowns(
+            listings, disclaimers, breakdown_fields, model=model_selection, priority=PRIORITY_INTERACTIVE)
+        save_dedup_report(dedup_report, timestamp)
+    st.session_state['dedup_report'] = dedup_report
 
-        all_ads_html = []
+    DynamicListingsContainer = create_listings_container_model(create_dynamic_listing_model(fields))
+    formatted_data = DynamicListingsContainer(listings=select_fields(listings, fields))
 
-        for ad in ads:
-            # Extract the full ad's HTML content
-            ad_html = ad.get_attribute("outerHTML")
+    input_tokens, output_tokens, total_cost = calculate_price(input_text, output_text, model=model_selection)
+    df = save_formatted_data(formatted_data, timestamp)
 
-            # Click the 'Offer Details and Disclaimers' button to open the modal/popup
-            button = ad.find_element(By.CSS_SELECTOR, 'button[data-title="Offer Details and Disclaimers"]')
-            driver.execute_script("arguments[0].scrollIntoView();", button)  # Scroll into view
-            time.sleep(1)  # Add a small delay to ensure it's in view
-            driver.execute_script("arguments[0].click();", button)
-
-            # Wait for the modal dialog to appear
-            WebDriverWait(driver, 10).until(
-                EC.visibility_of_element_located((By.CSS_SELECTOR, '.modal-dialog'))
-            )
-            
-            # Scrape the modal's HTML content
-            modal = driver.find_element(By.CSS_SELECTOR, '.modal-dialog')
-            modal_html = modal.get_attribute("outerHTML")
+    return df, formatted_data, source_text, input_tokens, output_tokens, total_cost, timestamp
 
-            # Combine the ad's HTML and the modal's HTML
-            full_ad_html = ad_html + modal_html
 
-            # Append the full ad + modal HTML to the list
-            all_ads_html.append(full_ad_html)
+# Define the scraping function
+def perform_scrape():
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    run = snapshot_store.start_run(selected_url_key, url_input, timestamp)
+    if fetch_method == "HTTP":
+        # Conditional GET: an unchanged page is served from the snapshot store
+        raw_html, _ = snapshot_store.fetch_http(url_input)
+    else:
+        raw_html = fetch_html_selenium(url_input)
+    run.add_page(raw_html)
+    run.save()
 
-            # Close the modal dialog
-            close_button = driver.find_element(By.CSS_SELECTOR, 'button.close[aria-label="Close"]')
-            driver.execute_script("arguments[0].click();", close_button)
+    return extract_listings([raw_html], timestamp)
 
-            time.sleep(1)  # Pause briefly between ads
 
-        # Combine all ads' HTML content into a single block
-        all_ads_content = "\n".join(all_ads_html)
+def perform_replay(run_id):
+    # Re-run conversion and extraction from stored snapshots, without any network access for the pages
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    all_ads_html = snapshot_store.load_run(run_id)
+    return extract_listings(all_ads_html, timestamp)
 
-        # Convert the ads' HTML content to Markdown
-        ads_markdown = html_to_markdown_with_readability(all_ads_content)
 
-        # Save the raw HTML and markdown content for future use
-        save_raw_data(ads_markdown, timestamp)
+def fetch_modal_html(driver, ad):
+    # Click the 'Offer Details and Disclaimers' button to open the modal/popup
+    button = ad.find_element(By.CSS_SELECTOR, 'button[data-title="Offer Details and Disclaimers"]')
+    driver.execute_script("arguments[0].scrollIntoView();", button)  # Scroll into view
+    time.sleep(1)  # Add a small delay to ensure it's in view
+    driver.execute_script("arguments[0].click();", button)
 
-        # Use dynamic models and process as needed
-        DynamicListingModel = create_dynamic_listing_model(fields)
-        DynamicListingsContainer = create_listings_container_model(DynamicListingModel)
-        formatted_data = format_data(ads_markdown, DynamicListingsContainer)
+    # Wait for the modal dialog to appear
+    WebDriverWait(driver, 10).until(
+        EC.visibility_of_element_located((By.CSS_SELECTOR, '.modal-dialog'))
+    )
 
-        formatted_data_text = json.dumps(formatted_data.dict())
-        input_tokens, output_tokens, total_cost = calculate_price(ads_markdown, formatted_data_text, model=model_selection)
-        df = save_formatted_data(formatted_data, timestamp)
+    # Scrape the modal's HTML content
+    modal = driver.find_element(By.CSS_SELECTOR, '.modal-dialog')
+    modal_html = modal.get_attribute("outerHTML")
 
-        return df, formatted_data, ads_markdown, input_tokens, output_tokens, total_cost, timestamp
+    # Close the modal dialog
+    close_button = driver.find_element(By.CSS_SELECTOR, 'button.close[aria-label="Close"]')
+    driver.execute_script("arguments[0].click();", close_button)
 
-    finally:
-        driver.quit()
+    time.sleep(1)  # Pause briefly between ads
+    return modal_html
 
 
-def perform_scrape_towne():
-    driver = setup_selenium()
+def scrape_ads_with_modals(ads_selector):
+    driver = setup_selenium(capture_network=capture_network)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
 
     try:
-        # Open the Towne page
+        # Open the specials page
         driver.get(url_input)
         time.sleep(3)  # Give time for the page to load
 
-        # Find all the ads (divs) with the class 'special-offer'
-        ads = driver.find_elements(By.CSS_SELECTOR, ".special-offer.card")
+        if capture_network:
+            responses = capture_json_responses(driver)
+            save_captured_responses(responses, timestamp)
+            if api_mapping:
+                listings, disclaimers = listings_from_responses(responses, api_mapping)
+                if listings:
+                    print(f"Built {len(listings)} listings from the site's JSON API")
+                    return extract_listings_from_api(listings, disclaimers, json.dumps(responses, indent=4), timestamp)
+                print("No captured response matched the API mapping, scraping the rendered page instead")
+
+        # Replay works from ad HTML, so only the rendered-page path records a snapshot run
+        run = snapshot_store.start_run(selected_url_key, url_input, timestamp)
+        ads = driver.find_elements(By.CSS_SELECTOR, ads_selector)
 
         all_ads_html = []
 
         for ad in ads:
             # Extract the full ad's HTML content
             ad_html = ad.get_attribute("outerHTML")
-            all_ads_html.append(ad_html)
-
-            time.sleep(1)  # Pause briefly between ads
 
-        # Combine all ads' HTML content into a single block
-        all_ads_content = "\n".join(all_ads_html)
+            # An unchanged ad reuses its stored modal instead of opening it again
+            modal_html = snapshot_store.detail_for(url_input, ad_html)
+            reused = modal_html is not None
+            if not reused:
+                modal_html = fetch_modal_html(driver, ad)
 
-        # Convert the ads' HTML content to Markdown
-        ads_markdown = html_to_markdown_with_readability(all_ads_content)
+            run.add_ad(ad_html, modal_html, detail_reused=reused)
 
-        # Save the raw HTML and markdown content for future use
-        save_raw_data(ads_markdown, timestamp)
-
-        # Use your dynamic models and process as before
-        DynamicListingModel = create_dynamic_listing_model(fields)
-        DynamicListingsContainer = create_listings_container_model(DynamicListingModel)
-        formatted_data = format_data(ads_markdown, DynamicListingsContainer)
-
-        formatted_data_text = json.dumps(formatted_data.dict())
-        input_tokens, output_tokens, total_cost = calculate_price(ads_markdown, formatted_data_text, model=model_selection)
-        df = save_formatted_data(formatted_data, timestamp)
+            # Combine the ad's HTML and the modal's HTML
+            all_ads_html.append(ad_html + modal_html)
 
-        return df, formatted_data, ads_markdown, input_tokens, output_tokens, total_cost, timestamp
+        run.save()
+        return extract_listings(all_ads_html, timestamp)
 
     finally:
         driver.quit()
 
 
-def perform_scrape_westherr():
+def perform_scrape_cecconi():
+    # Find all the ads (divs) with the class 'promo promo-type-vehicle' and 'promo promo-type-incentive'
+    return scrape_ads_with_modals(".promo.promo-type-vehicle, .promo.promo-type-incentive")
+
+
+def perform_scrape_towne():
     driver = setup_selenium()
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    run = snapshot_store.start_run(selected_url_key, url_input, timestamp)
 
     try:
         # Open the Towne page
@@ -237,137 +311,97 @@ def perform_scrape_westherr():
         time.sleep(3)  # Give time for the page to load
 
         # Find all the ads (divs) with the class 'special-offer'
-        ads = driver.find_elements(By.CSS_SELECTOR, ".row .col-lg-4.col-md-6")
+        ads = driver.find_elements(By.CSS_SELECTOR, ".special-offer.card")
 
         all_ads_html = []
-        wait = WebDriverWait(driver, 20)  # Define WebDriverWait
-
-        for index, ad in enumerate(ads):
-          try:
-            ad_full_html =""
 
+        for ad in ads:
             # Extract the full ad's HTML content
             ad_html = ad.get_attribute("outerHTML")
-            ad_full_html += ad_html  # Append the ad's HTML to the full HTML content
-                        # Click 'More Details' button
-            more_details_button = ad.find_element(By.LINK_TEXT, "More Details")
-            driver.execute_script("window.open(arguments[0].href);", more_details_button)
-            driver.switch_to.window(driver.window_handles[-1])
-
-            time.sleep(2)  # Allow page to load
-
-            lease_terms_div = wait.until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "div.col-md-6 > div.border.rounded.bg-slate-50"))
-                )         
-            lease_terms_html = lease_terms_div.get_attribute("outerHTML")
-            ad_full_html += lease_terms_html  # Append the lease terms to the ad's HTML content
-            time.sleep(1)  # Pause briefly between ads
-
-            all_ads_html.append(ad_full_html)
-            # Locate the "Back to Special Listings" button
-            driver.close()
-
-            # Use JavaScript to click the button
-            driver.switch_to.window(driver.window_handles[0])
-
-            time.sleep(2)
-
-          except StaleElementReferenceException:
-                ads = driver.find_elements(By.CSS_SELECTOR, ".row .col-lg-4.col-md-6")
-
-        # Combine all ads' HTML content into a single block
-        all_ads_content = "\n".join(all_ads_html)
-
-        # Convert the ads' HTML content to Markdown
-        ads_markdown = html_to_markdown_with_readability(all_ads_content)
-
-        # Save the raw HTML and markdown content for future use
-        save_raw_data(ads_markdown, timestamp)
-
-        # Use your dynamic models and process as before
-        DynamicListingModel = create_dynamic_listing_model(fields)
-        DynamicListingsContainer = create_listings_container_model(DynamicListingModel)
-        formatted_data = format_data(ads_markdown, DynamicListingsContainer)
+            run.add_ad(ad_html)
+            all_ads_html.append(ad_html)
 
-        formatted_data_text = json.dumps(formatted_data.dict())
-        input_tokens, output_tokens, total_cost = calculate_price(ads_markdown, formatted_data_text, model=model_selection)
-        df = save_formatted_data(formatted_data, timestamp)
+            time.sleep(1)  # Pause briefly between ads
 
-        return df, formatted_data, ads_markdown, input_tokens, output_tokens, total_cost, timestamp
+        run.save()
+        return extract_listings(all_ads_html, timestamp)
 
     finally:
         driver.quit()
 
 
-def perform_scrape_northtown():
-
+def perform_scrape_westherr():
     driver = setup_selenium()
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    run = snapshot_store.start_run(selected_url_key, url_input, timestamp)
 
     try:
-        # Open the Cecconi page
+        # Open the Towne page
         driver.get(url_input)
         time.sleep(3)  # Give time for the page to load
 
-        # Find all the ads (divs) with the class 'promo promo-type-vehicle' and 'promo promo-type-incentive'
-        ads = driver.find_elements(By.CSS_SELECTOR, 'div.page-section[data-name="specials-listing-wrapper-1"] .promo.promo-type-vehicle') 
+        # Find all the ads (divs) with the class 'special-offer'
+        ads = driver.find_elements(By.CSS_SELECTOR, ".row .col-lg-4.col-md-6")
 
         all_ads_html = []
+        wait = WebDriverWait(driver, 20)  # Define WebDriverWait
 
-        for ad in ads:
+        for index, ad in enumerate(ads):
+          try:
             # Extract the full ad's HTML content
             ad_html = ad.get_attribute("outerHTML")
 
-            # Click the 'Offer Details and Disclaimers' button to open the modal/popup
-            button = ad.find_element(By.CSS_SELECTOR, 'button[data-title="Offer Details and Disclaimers"]')
-            driver.execute_script("arguments[0].scrollIntoView();", button)  # Scroll into view
-            time.sleep(1)  # Add a small delay to ensure it's in view
-            driver.execute_script("arguments[0].click();", button)
-
-            # Wait for the modal dialog to appear
-            WebDriverWait(driver, 10).until(
-                EC.visibility_of_element_located((By.CSS_SELECTOR, '.modal-dialog'))
-            )
-            
-            # Scrape the modal's HTML content
-            modal = driver.find_element(By.CSS_SELECTOR, '.modal-dialog')
-            modal_html = modal.get_attribute("outerHTML")
+            # An unchanged ad reuses its stored lease terms instead of opening the details page
+            lease_terms_html = snapshot_store.detail_for(url_input, ad_html)
+            reused = lease_terms_html is not None
+            if not reused:
+                # Click 'More Details' button
+                more_details_button = ad.find_element(By.LINK_TEXT, "More Details")
+                driver.execute_script("window.open(arguments[0].href);", more_details_button)
+                driver.switch_to.window(driver.window_handles[-1])
 
-            # Combine the ad's HTML and the modal's HTML
-            full_ad_html = ad_html + modal_html
-
-            # Append the full ad + modal HTML to the list
-            all_ads_html.append(full_ad_html)
-
-            # Close the modal dialog
-            close_button = driver.find_element(By.CSS_SELECTOR, 'button.close[aria-label="Close"]')
-            driver.execute_script("arguments[0].click();", close_button)
+                time.sleep(2)  # Allow page to load
 
-            time.sleep(1)  # Pause briefly between ads
+                lease_terms_div = wait.until(
+                        EC.presence_of_element_located((By.CSS_SELECTOR, "div.col-md-6 > div.border.rounded.bg-slate-50"))
+                    )
+                lease_terms_html = lease_terms_div.get_attribute("outerHTML")
+                time.sleep(1)  # Pause briefly between ads
 
-        # Combine all ads' HTML content into a single block
-        all_ads_content = "\n".join(all_ads_html)
+                # Locate the "Back to Special Listings" button
+                driver.close()
 
-        # Convert the ads' HTML content to Markdown
-        ads_markdown = html_to_markdown_with_readability(all_ads_content)
+                # Use JavaScript to click the button
+                driver.switch_to.window(driver.window_handles[0])
 
-        # Save the raw HTML and markdown content for future use
-        save_raw_data(ads_markdown, timestamp)
+                time.sleep(2)
 
-        # Use dynamic models and process as needed
-        DynamicListingModel = create_dynamic_listing_model(fields)
-        DynamicListingsContainer = create_listings_container_model(DynamicListingModel)
-        formatted_data = format_data(ads_markdown, DynamicListingsContainer)
+            run.add_ad(ad_html, lease_terms_html, detail_reused=reused)
+            # Append the lease terms to the ad's HTML content
+            all_ads_html.append(ad_html + lease_terms_html)
 
-        formatted_data_text = json.dumps(formatted_data.dict())
-        input_tokens, output_tokens, total_cost = calculate_price(ads_markdown, formatted_data_text, model=model_selection)
-        df = save_formatted_data(formatted_data, timestamp)
+          except StaleElementReferenceException:
+                ads = driver.find_elements(By.CSS_SELECTOR, ".row .col-lg-4.col-md-6")
 
-        return df, formatted_data, ads_markdown, input_tokens, output_tokens, total_cost, timestamp
+        run.save()
+        return extract_listings(all_ads_html, timestamp)
 
     finally:
         driver.quit()
 
+
+def perform_scrape_northtown():
+    # Find all the ads (divs) with the class 'promo promo-type-vehicle' and 'promo promo-type-incentive'
+    return scrape_ads_with_modals('div.page-section[data-name="specials-listing-wrapper-1"] .promo.promo-type-vehicle')
+
+# Live browser usage on this host, so worker counts can be sized against memory
+browser_stats = get_governor().stats()
+st.sidebar.markdown("## Browsers")
+st.sidebar.markdown(f"**Running:** {browser_stats['host_browsers']} / {browser_stats['max_concurrent']} "
+                    f"({browser_stats['host_processes']} processes)")
+st.sidebar.markdown(f"**Memory:** {browser_stats['host_rss_mb']} MB (limit {browser_stats['max_rss_mb']} MB per browser)")
+st.sidebar.markdown(f"**Recycled / Reaped:** {browser_stats['recycled']} / {browser_stats['reaped']}")
+
 # Handling button press for scraping
 if 'perform_scrape' not in st.session_state:
     st.session_state['perform_scrape'] = False
@@ -375,7 +409,10 @@ if 'perform_scrape' not in st.session_state:
 
 if st.sidebar.button("Scrape"):
     with st.spinner('Please wait... Data is being scraped.'):
-        if selected_url_key == "Cecconi":
+        if replay_run_id:
+            # Extract from stored snapshots, no scraping
+            st.session_state['results'] = perform_replay(replay_run_id)
+        elif selected_url_key == "Cecconi":
             # Call the specific Cecconi scrape logic
             st.session_state['results'] = perform_scrape_cecconi()
         elif selected_url_key == "Towne":
@@ -403,6 +440,21 @@ if st.session_state.get('perform_scrape'):
     st.sidebar.markdown(f"**Output Tokens:** {output_tokens}")
     st.sidebar.markdown(f"**Total Cost:** :green-background[***${total_cost:.4f}***]")
 
+    # Shared LLM gateway health (queueing and rate limiting across all scrapes in this process)
+    llm_metrics = get_gateway().metrics()
+    st.sidebar.markdown("## LLM Gateway")
+    st.sidebar.markdown(f"**Queue Depth:** {llm_metrics['queue_depth']} (max {llm_metrics['queue_depth_max']})")
+    st.sidebar.markdown(f"**Avg / Max Wait:** {llm_metrics['wait_time_avg']:.1f}s / {llm_metrics['wait_time_max']:.1f}s")
+    st.sidebar.markdown(f"**Retries:** {llm_metrics['retries']} ({llm_metrics['rate_limited']} rate limited)")
+
+    dedup_report = st.session_state.get('dedup_report')
+    if dedup_report:
+        st.sidebar.markdown("## Disclaimer Dedup")
+        st.sidebar.markdown(f"**Disclaimers / Templates:** {dedup_report['ads_with_disclaimer']} / {dedup_report['templates']} "
+                            f"({dedup_report['templates_from_cache']} cached)")
+        st.sidebar.markdown(f"**Dedup Ratio:** {dedup_report['dedup_ratio']:.0%}")
+        st.sidebar.markdown(f"**Tokens Avoided:** {dedup_report['tokens_avoided']}")
+
     # Create columns for download buttons
     col1, col2, col3 = st.columns(3)
     with col1:
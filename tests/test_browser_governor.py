@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from types import SimpleNamespace
+
+import psutil
+import pytest
+from selenium.webdriver.chrome.options import Options
+
+import browser_governor
+from browser_governor import BrowserGovernor
+
+SLEEPER = [sys.executable, "-c", "import time; time.sleep(120)"]
+
+
+@pytest.fixture
+def spawn():
+    processes = []
+
+    def start(*args):
+        process = subprocess.Popen(SLEEPER + list(args))
+        processes.append(process)
+        return process
+
+    yield start
+    for process in processes:
+        process.kill()
+        process.wait()
+
+
+@pytest.fixture
+def dead_owner():
+    # A pid that existed but is gone; the bogus start time also rules out pid reuse
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return {"owner_pid": process.pid, "owner_create_time": 1.0}
+
+
+def write_slot(governor, number, **slot):
+    with open(governor._slot_path(number), "w", encoding="utf-8") as f:
+        json.dump(slot, f)
+
+
+def wait_dead(process):
+    process.wait(timeout=5)
+    return process.returncode is not None
+
+
+def make_governor(tmp_path, **kwargs):
+    options = dict(max_concurrent=1, slot_timeout=2, check_interval=0.2, state_dir=str(tmp_path))
+    options.update(kwargs)
+    return BrowserGovernor(**options)
+
+
+def test_acquire_kills_dead_owners_browser_before_reusing_its_slot(tmp_path, spawn, dead_owner):
+    governor = make_governor(tmp_path)
+    driver = spawn()
+    write_slot(governor, 0, driver_pid=driver.pid, driver_create_time=psutil.Process(driver.pid).create_time(), **dead_owner)
+
+    slot = governor.acquire_slot()
+
+    assert slot == governor._slot_path(0)
+    assert wait_dead(driver)
+    with open(slot, "r", encoding="utf-8") as f:
+        assert json.load(f)["owner_pid"] == os.getpid()
+
+
+def test_reap_orphans_kills_drivers_and_marked_chrome_of_dead_owners(tmp_path, spawn, dead_owner):
+    governor = make_governor(tmp_path)
+    driver = spawn()
+    write_slot(governor, 0, driver_pid=driver.pid, driver_create_time=psutil.Process(driver.pid).create_time(), **dead_owner)
+    profile = os.path.join(governor.profile_dir, f"{dead_owner['owner_pid']}-1-deadbeef")
+    os.makedirs(profile)
+    chrome = spawn(f"--user-data-dir={profile}")
+    unrelated = spawn("--user-data-dir=/somewhere/else")
+    time.sleep(0.2)  # Let the command lines become visible
+
+    assert governor.reap_orphans() == 2
+
+    assert wait_dead(driver) and wait_dead(chrome)
+    assert unrelated.poll() is None
+    assert os.listdir(governor.slot_dir) == []
+    assert not os.path.exists(profile)
+
+
+def test_live_slot_is_not_removed_by_a_racing_reclaim(tmp_path, monkeypatch, dead_owner):
+    governor = make_governor(tmp_path)
+    live = {"owner_pid": os.getpid(), "owner_create_time": psutil.Process().create_time()}
+    write_slot(governor, 0, **live)
+
+    # This process judged the slot stale from an earlier read; meanwhile another process took it over
+    real_stale = governor._slot_stale
+    answers = iter([True])
+    monkeypatch.setattr(governor, "_slot_stale", lambda slot, path: next(answers, None) or real_stale(slot, path))
+
+    assert governor._reclaim_slot(governor._slot_path(0)) is None
+    with open(governor._slot_path(0), "r", encoding="utf-8") as f:
+        assert json.load(f) == live
+    assert os.listdir(governor.slot_dir) == ["slot-0.json"]
+
+
+def test_live_slot_kept_aside_by_a_reclaim_race_still_counts_until_its_browser_exits(tmp_path, spawn):
+    governor = make_governor(tmp_path, slot_timeout=0.5)
+    driver = spawn()
+    kept = governor._slot_path(0) + ".0badf00d.reclaim"
+    with open(kept, "w", encoding="utf-8") as f:
+        json.dump({"owner_pid": os.getpid(), "owner_create_time": psutil.Process().create_time(),
+                   "driver_pid": driver.pid, "driver_create_time": psutil.Process(driver.pid).create_time()}, f)
+    # rename() keeps the original mtime, so the file looks old
+    os.utime(kept, (time.time() - 3600, time.time() - 3600))
+
+    assert governor.reap_orphans() == 0
+    assert os.path.exists(kept) and driver.poll() is None
+    assert governor.stats()["host_browsers"] == 1
+    with pytest.raises(RuntimeError):
+        governor.acquire_slot()
+
+    driver.kill()
+    driver.wait()
+    governor.reap_orphans()
+    assert os.listdir(governor.slot_dir) == []
+    assert governor.acquire_slot() == governor._slot_path(0)
+
+
+def test_release_does_not_remove_a_slot_owned_by_someone_else(tmp_path, dead_owner):
+    governor = make_governor(tmp_path)
+    write_slot(governor, 0, owner_pid=os.getpid() + 1, owner_create_time=1.0, driver_pid=1)
+
+    governor._release_slot(governor._slot_path(0), driver_pid=12345)
+
+    assert os.listdir(governor.slot_dir) == ["slot-0.json"]
+
+
+def test_host_wide_cap_and_lifetime_recycling(tmp_path, monkeypatch, spawn):
+    governor = make_governor(tmp_path, max_lifetime=60, slot_timeout=0.5)
+    drivers = []
+
+    def fake_chrome(options):
+        drivers.append(spawn(*options.arguments))
+        return SimpleNamespace(service=SimpleNamespace(process=drivers[-1]))
+
+    monkeypatch.setattr(browser_governor.webdriver, "Chrome", fake_chrome)
+    monkeypatch.setattr(governor, "start", lambda: None)
+
+    governor.launch(Options())
+    assert governor.stats()["host_browsers"] == 1
+    with pytest.raises(RuntimeError):
+        governor.launch(Options())
+
+    governor.max_lifetime = 0.01
+    governor.check()
+
+    assert wait_dead(drivers[0])
+    assert governor.recycled == 1
+    assert governor.stats()["host_browsers"] == 0
+    governor.launch(Options())
+    assert len(drivers) == 2
+
+
+def test_get_governor_reaps_at_startup(tmp_path, monkeypatch, spawn, dead_owner):
+    monkeypatch.setenv("BROWSER_STATE_DIR", str(tmp_path))
+    monkeypatch.setenv("BROWSER_REAP_INTERVAL_S", "3600")
+    monkeypatch.setattr(browser_governor, "_governor", None)
+    profile_dir = tmp_path / "profiles" / f"{dead_owner['owner_pid']}-1-cafebabe"
+    profile_dir.mkdir(parents=True)
+    chrome = spawn(f"--user-data-dir={profile_dir}")
+    time.sleep(0.2)
+
+    governor = browser_governor.get_governor()
+    watchdog = governor._watchdog
+    try:
+        assert watchdog is not None and watchdog.is_alive()
+        assert wait_dead(chrome)
+        assert governor.reaped == 1
+    finally:
+        # Otherwise the thread keeps reaping the deleted tmp_path for the rest of the session
+        governor.stop()
+    assert not watchdog.is_alive()
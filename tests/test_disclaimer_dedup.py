@@ -0,0 +1,178 @@
+from types import SimpleNamespace
+
+import pytest
+
+import disclaimer_dedup
+from disclaimer_dedup import (
+    AD_REF_FIELD, TemplateBreakdown, TemplateBreakdownsContainer, apply_disclaimer_breakdowns,
+    build_templates, collect_disclaimers, dedup_pays_off, find_breakdown_fields, group_near_duplicates,
+    reference_templates, _build_template,
+)
+from scraper import html_to_markdown_with_readability
+
+FINE_PRINT = ("Lease {model} for ${payment}/month for 36 months with $3,999 due at signing. MSRP ${msrp}. "
+              "Stock #{stock}. 10,000 miles per year, $.25 per mile thereafter. Taxes, title and dealer fees extra. "
+              "On approved credit through Chrysler Capital. Not all customers will qualify.")
+
+
+def cecconi_ad(model, payment, msrp, stock):
+    text = FINE_PRINT.format(model=model, payment=payment, msrp=msrp, stock=stock)
+    return (f'<div class="promo promo-type-vehicle"><h3>2025 Jeep {model}</h3><span>$ {payment}/mo</span></div>'
+            f'<div class="modal-dialog"><div class="modal-body"><p>{text}</p></div></div>')
+
+
+ADS = [
+    cecconi_ad("Grand Cherokee", "399", "45,120", "J1234"),
+    cecconi_ad("Compass", "299", "35,935", "J2001"),
+    cecconi_ad("Wrangler", "449", "49,700", "J3077"),
+]
+
+
+class WordEncoder:
+    def encode(self, text):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def offline_tokenizer(monkeypatch):
+    monkeypatch.setattr(disclaimer_dedup.tiktoken, "encoding_for_model", lambda model: WordEncoder())
+
+
+def test_main_prompt_keeps_fine_print_fields_and_sends_boilerplate_once():
+    ads_html, disclaimers = collect_disclaimers(ADS)
+    templates, assignments = build_templates(disclaimers)
+    markdown = " ".join(html_to_markdown_with_readability("\n".join(reference_templates(ads_html, templates, assignments))).split())
+
+    # Slot values carry what differs per ad, right under that ad
+    ad_1 = markdown[markdown.index(f"{AD_REF_FIELD}: 1"):markdown.index(f"{AD_REF_FIELD}: 2")]
+    assert "$45,120" in ad_1 and "#J1234" in ad_1 and "Grand Cherokee" in ad_1
+    assert "$49,700" in markdown[markdown.index(f"{AD_REF_FIELD}: 3"):]
+    # Shared terms appear once, in the template
+    assert "MSRP <<" in markdown
+    assert markdown.count("36 months") == 1 and markdown.count("10,000 miles per year") == 1
+    assert markdown.count("Chrysler Capital") == 1
+    assert "MSRP $45,120" in disclaimers[0]
+
+
+def test_ads_without_fine_print_have_no_disclaimer():
+    _, disclaimers = collect_disclaimers(['<div class="special-offer card"><h3>2025 Ram 1500</h3><p>$549/mo</p></div>'])
+    assert disclaimers == [""]
+
+
+def test_variants_group_into_one_template_with_slot_values():
+    _, disclaimers = collect_disclaimers(ADS)
+    templates, assignments = build_templates(disclaimers)
+
+    assert len(templates) == 1
+    assert "Chrysler Capital" in templates[0]
+    assert "45,120" not in templates[0] and "J1234" not in templates[0]
+    slot_values = [assignment[1] for assignment in assignments]
+    assert any("#J1234." in value for value in slot_values[0].values())
+    assert any("#J3077." in value for value in slot_values[2].values())
+
+    # Filling the template from an ad's slots gives back that ad's disclaimer
+    template_index, values = assignments[1]
+    filled = templates[template_index]
+    for number, value in values.items():
+        filled = filled.replace(f"<<{number}>>", value)
+    assert filled == disclaimers[1]
+
+
+def test_unrelated_disclaimers_are_not_grouped():
+    texts = [
+        FINE_PRINT.format(model="Compass", payment="299", msrp="35,935", stock="J2001"),
+        "Purchase price includes all available rebates and incentives. Financing at 2.9% APR for 60 months "
+        "with approved credit through Ally. See dealer for complete details, offer ends soon.",
+    ]
+    assert sorted(map(sorted, group_near_duplicates(texts))) == [[0], [1]]
+
+
+def test_build_template_handles_inserted_and_deleted_tokens():
+    template, values = _build_template([
+        "Offer valid on stock 100 only. Taxes extra.",
+        "Offer valid on stock 200 and 201 only. Taxes extra.",
+        "Offer valid on only. Taxes extra.",
+    ])
+    assert template == "Offer valid on <<1>> only. Taxes extra."
+    assert [v["1"] for v in values] == ["stock 100", "stock 200 and 201", ""]
+
+
+def test_build_template_rejects_mostly_different_variants():
+    assert _build_template(["one two three four", "five six seven four"]) is None
+
+
+def test_find_breakdown_fields_orders_by_number():
+    fields = ["Car Name", "Disclaimer Breakdown 10", "Disclaimer Breakdown 2", "Details", "Disclaimer Breakdown 1"]
+    assert find_breakdown_fields(fields) == ["Disclaimer Breakdown 1", "Disclaimer Breakdown 2", "Disclaimer Breakdown 10"]
+
+
+class FakeGateway:
+    def __init__(self):
+        self.calls = []
+
+    def parse(self, model, messages, response_format, priority):
+        self.calls.append(messages)
+        # Break every template in the prompt into its sentences
+        templates = [block.split("\n", 1) for block in messages[1]["content"].split("\n\n")]
+        parsed = TemplateBreakdownsContainer(templates=[
+            TemplateBreakdown(template_id=int(header.split()[1].rstrip(":")), points=[s.strip().rstrip(".") + "." for s in body.split(". ") if s])
+            for header, body in templates
+        ])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(parsed=parsed))])
+
+
+def test_each_template_is_broken_down_once_and_cached(monkeypatch, tmp_path):
+    gateway = FakeGateway()
+    monkeypatch.setattr(disclaimer_dedup, "get_gateway", lambda: gateway)
+    _, disclaimers = collect_disclaimers(ADS)
+    breakdown_fields = [f"Disclaimer Breakdown {i}" for i in range(1, 4)]
+    listings = [{"Car Name": f"car {ref}", AD_REF_FIELD: str(ref)} for ref in (3, 1, 2)]
+    cache_path = str(tmp_path / "templates.json")
+
+    merged, report, _, output_text = apply_disclaimer_breakdowns(listings, disclaimers, breakdown_fields, "gpt-4o-mini", cache_path=cache_path)
+
+    assert len(gateway.calls) == 1
+    assert AD_REF_FIELD not in merged[0]
+    # Listings are matched to their ad by Ad Ref, not by position
+    breakdowns = [" ".join(listing[field] for field in breakdown_fields) for listing in merged]
+    assert "Wrangler" in merged[0]["Disclaimer Breakdown 1"]
+    assert "MSRP $49,700" in breakdowns[0] and "#J3077" in breakdowns[0]
+    assert "MSRP $45,120" in breakdowns[1] and "#J1234" in breakdowns[1]
+    # Overflowing points are merged into the last field rather than dropped
+    assert merged[0]["Disclaimer Breakdown 3"].endswith("Not all customers will qualify.")
+    assert report["templates"] == 1 and report["ads_with_disclaimer"] == 3
+    assert report["dedup_ratio"] == pytest.approx(2 / 3, abs=1e-3)
+    assert output_text and report["breakdown_output_tokens"] == len(output_text.split())
+
+    # Same boilerplate on another run (or dealer) is served from the cache
+    _, report, prompt_text, output_text = apply_disclaimer_breakdowns(listings, disclaimers, breakdown_fields, "gpt-4o-mini", cache_path=cache_path)
+    assert len(gateway.calls) == 1
+    # Nothing generated, nothing to price
+    assert prompt_text == "" and output_text == ""
+    assert report["templates_from_cache"] == 1
+    assert report["tokens_avoided"] == report["disclaimer_input_tokens"] + report["per_ad_breakdown_tokens"]
+
+
+def test_references_cost_less_than_repeated_fine_print(monkeypatch, tmp_path):
+    monkeypatch.setattr(disclaimer_dedup, "get_gateway", FakeGateway)
+    ads = ADS + [cecconi_ad("Gladiator", "499", "52,000", "J4100"), cecconi_ad("Cherokee", "349", "39,000", "J5100")]
+    ads_html, disclaimers = collect_disclaimers(ads)
+    built = build_templates(disclaimers)
+    breakdown_fields = [f"Disclaimer Breakdown {i}" for i in range(1, 4)]
+    listings = [{"Car Name": f"car {ref}", AD_REF_FIELD: str(ref)} for ref in range(1, len(ads) + 1)]
+
+    _, report, _, _ = apply_disclaimer_breakdowns(listings, disclaimers, breakdown_fields, "gpt-4o-mini",
+                                                  cache_path=str(tmp_path / "templates.json"), built=built)
+
+    assert report["templates_from_cache"] == 0
+    assert 0 < report["reference_input_tokens"] < report["disclaimer_input_tokens"]
+    assert report["tokens_avoided"] > 0
+
+
+def test_single_uncached_disclaimer_is_not_worth_a_breakdown_call(tmp_path):
+    cache_path = str(tmp_path / "templates.json")
+    _, disclaimers = collect_disclaimers(ADS[:1])
+    assert not dedup_pays_off(*build_templates(disclaimers), "gpt-4o-mini", cache_path)
+
+    _, disclaimers = collect_disclaimers(ADS)
+    assert dedup_pays_off(*build_templates(disclaimers), "gpt-4o-mini", cache_path)
@@ -0,0 +1,204 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+import llm_gateway
+from llm_gateway import LLMGateway, TokenBucket, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+
+
+def rate_limit_error(headers):
+    response = SimpleNamespace(status_code=429, headers=headers, request=None)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def completion(total_tokens=10):
+    return SimpleNamespace(choices=[], usage=SimpleNamespace(total_tokens=total_tokens))
+
+
+class StandInClient:
+    """Local stand-in for the OpenAI client: replays a script of errors/completions and records calls."""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = []
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self.parse)))
+
+    def parse(self, **kwargs):
+        self.calls.append(kwargs)
+        outcome = self.script.pop(0) if self.script else completion()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def make_gateway(client, **kwargs):
+    options = dict(api_key="test", rpm_limit=600, tpm_limit=100000, max_retries=3,
+                   max_output_tokens=100, backoff_base=0.01, backoff_max=0.05, client=client)
+    options.update(kwargs)
+    gateway = LLMGateway(**options)
+    gateway.estimate_tokens = lambda messages, model: 50
+    return gateway
+
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(llm_gateway.time, "sleep", recorded.append)
+    return recorded
+
+
+def test_retry_after_seconds_is_honored(sleeps):
+    client = StandInClient([rate_limit_error({"retry-after": "0.5"}), completion()])
+    gateway = make_gateway(client)
+
+    gateway.parse("gpt-4o-mini", MESSAGES, response_format=None)
+
+    assert len(client.calls) == 2
+    assert len(sleeps) == 1 and 0.5 <= sleeps[0] <= 0.5 + gateway.backoff_base
+    metrics = gateway.metrics()
+    assert metrics["rate_limited"] == 1
+    assert metrics["retries"] == 1
+    assert metrics["completed"] == 1
+
+
+def test_retry_after_ms_takes_precedence(sleeps):
+    client = StandInClient([rate_limit_error({"retry-after-ms": "250", "retry-after": "9"}), completion()])
+    gateway = make_gateway(client)
+
+    gateway.parse("gpt-4o-mini", MESSAGES, response_format=None)
+
+    assert 0.25 <= sleeps[0] <= 0.25 + gateway.backoff_base
+
+
+def test_retry_without_header_uses_capped_jittered_backoff(sleeps):
+    client = StandInClient([rate_limit_error({}), rate_limit_error({}), completion()])
+    gateway = make_gateway(client)
+
+    gateway.parse("gpt-4o-mini", MESSAGES, response_format=None)
+
+    assert len(sleeps) == 2
+    assert all(0 <= delay <= gateway.backoff_max for delay in sleeps)
+
+
+def test_retries_exhausted_raises(sleeps):
+    client = StandInClient([rate_limit_error({"retry-after": "0"})] * 10)
+    gateway = make_gateway(client, max_retries=2)
+
+    with pytest.raises(openai.RateLimitError):
+        gateway.parse("gpt-4o-mini", MESSAGES, response_format=None)
+
+    assert len(client.calls) == 3
+    metrics = gateway.metrics()
+    assert metrics["failed"] == 1
+    assert metrics["retries"] == 2
+
+
+def test_non_retryable_error_is_not_retried(sleeps):
+    response = SimpleNamespace(status_code=400, headers={}, request=None)
+    client = StandInClient([openai.BadRequestError("bad", response=response, body=None)])
+    gateway = make_gateway(client)
+
+    with pytest.raises(openai.BadRequestError):
+        gateway.parse("gpt-4o-mini", MESSAGES, response_format=None)
+
+    assert len(client.calls) == 1
+    assert sleeps == []
+
+
+def test_unused_reservation_is_returned():
+    client = StandInClient([completion(total_tokens=30)])
+    gateway = make_gateway(client, tpm_limit=1000)
+
+    gateway.parse("gpt-4o-mini", MESSAGES, response_format=None)
+
+    # Reserved 50 prompt + 100 output, used 30
+    assert gateway.token_bucket.tokens == pytest.approx(970, abs=1)
+    assert client.calls[0]["max_tokens"] == 100
+
+
+def test_other_failures_settle_the_reservation_and_count_as_failed(sleeps):
+    truncated = openai.LengthFinishReasonError(completion=completion(total_tokens=120))
+    client = StandInClient([ValueError("structured output did not validate"), truncated])
+    gateway = make_gateway(client, tpm_limit=1000)
+
+    with pytest.raises(ValueError):
+        gateway.parse("gpt-4o-mini", MESSAGES, response_format=None)
+    # Nothing known to be used: the whole 150 token reservation is returned
+    assert gateway.token_bucket.tokens == pytest.approx(1000, abs=1)
+
+    with pytest.raises(openai.LengthFinishReasonError):
+        gateway.parse("gpt-4o-mini", MESSAGES, response_format=None)
+    # Settled with the truncated completion's usage
+    assert gateway.token_bucket.tokens == pytest.approx(880, abs=1)
+
+    metrics = gateway.metrics()
+    assert metrics["failed"] == 2 and metrics["retries"] == 0
+    assert metrics["tokens_used"] == 120
+    assert len(client.calls) == 2 and sleeps == []
+
+
+def test_missing_api_key_fails_without_holding_tokens():
+    gateway = make_gateway(None, tpm_limit=1000)
+    gateway.api_key = None
+
+    with pytest.raises(RuntimeError):
+        gateway.parse("gpt-4o-mini", MESSAGES, response_format=None)
+
+    assert gateway.token_bucket.tokens == pytest.approx(1000, abs=1)
+    assert gateway.metrics()["failed"] == 1
+
+
+def _wait_for_queue_depth(gateway, depth):
+    deadline = time.monotonic() + 5
+    while gateway.metrics()["queue_depth"] < depth:
+        assert time.monotonic() < deadline, "request never queued"
+        time.sleep(0.01)
+
+
+def test_interactive_lane_is_admitted_before_batch():
+    client = StandInClient([])
+    gateway = make_gateway(client)
+    order = []
+
+    def call(priority, name):
+        gateway.parse("gpt-4o-mini", MESSAGES, response_format=None, priority=priority)
+        order.append(name)
+
+    # Hold admissions while both lanes queue up, batch first
+    gateway._block_for(0.3)
+    batch = threading.Thread(target=call, args=(PRIORITY_BATCH, "batch"))
+    batch.start()
+    _wait_for_queue_depth(gateway, 1)
+    interactive = threading.Thread(target=call, args=(PRIORITY_INTERACTIVE, "interactive"))
+    interactive.start()
+    _wait_for_queue_depth(gateway, 2)
+
+    metrics = gateway.metrics()
+    assert metrics["queue_depth_interactive"] == 1
+    assert metrics["queue_depth_batch"] == 1
+
+    batch.join(5)
+    interactive.join(5)
+    assert order == ["interactive", "batch"]
+    assert gateway.metrics()["wait_time_max"] > 0.2
+
+
+def test_token_bucket_refill_and_wait_time():
+    bucket = TokenBucket(limit_per_minute=60)  # 1 token per second
+    now = bucket.updated
+
+    assert bucket.wait_time(60, now) == 0
+    bucket.take(60)
+    assert bucket.wait_time(10, now) == pytest.approx(10)
+    assert bucket.wait_time(10, now + 4) == pytest.approx(6)
+    # Requests larger than the bucket only wait for a full bucket
+    assert bucket.wait_time(1000, now + 4) == pytest.approx(56)
+
+    bucket.give_back(1000)
+    assert bucket.tokens == 60
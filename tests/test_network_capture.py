@@ -0,0 +1,74 @@
+from network_capture import _to_text, listings_from_responses, resolve_path, select_fields
+
+DISCLAIMER_HTML = ("<p>Lease for <b>$399/month</b> for 36 months.</p>\n"
+                   "<p>MSRP $45,120. Stock #J1234. Taxes, title and fees extra.</p>")
+
+
+def offer(offer_id, model, msrp, disclaimer=""):
+    return {"id": offer_id, "year": 2025, "make": "Jeep", "model": model,
+            "pricing": {"msrp": msrp, "payments": [{"term": 36, "amount": "399"}]},
+            "features": ["Leather", "Sunroof"], "disclaimer": disclaimer}
+
+
+# Shaped like what capture_json_responses() returns for a paginated specials API
+RESPONSES = [
+    {"url": "https://dealer.example/api/specials?page=1", "status": 200,
+     "data": {"data": {"offers": [offer(1, "Grand Cherokee", "$45,120", DISCLAIMER_HTML), offer(2, "Compass", "$35,935")]}}},
+    {"url": "https://dealer.example/api/specials?page=2", "status": 200,
+     "data": {"data": {"offers": [offer(2, "Compass", "$35,935"), offer(3, "Wrangler", "$49,700")]}}},
+    {"url": "https://analytics.example/collect", "status": 200,
+     "data": {"data": {"offers": [offer(9, "Tracking", "$0")]}}},
+]
+
+MAPPING = {
+    "url_pattern": r"/api/specials",
+    "records": "data.offers",
+    "fields": {"Car Name": ["year", "make", "model"], "MSRP": "pricing.msrp", "Features": "features"},
+    "disclaimer": "disclaimer",
+}
+
+
+def test_resolve_path_walks_wildcards_indexes_and_skips_missing_keys():
+    data = {"groups": {"suv": [{"name": "Compass"}, {"name": "Wrangler"}], "truck": [{"name": "Gladiator"}]}}
+
+    assert resolve_path(data, "groups.*.*.name") == ["Compass", "Wrangler", "Gladiator"]
+    assert resolve_path(data, "groups.suv.1.name") == ["Wrangler"]
+    assert resolve_path(data, "groups.suv.5.name") == []
+    assert resolve_path(data, "groups.van.*.name") == []
+    assert resolve_path(data, "groups.suv.0.price") == []
+    assert resolve_path(data, "") == [data]
+
+
+def test_to_text_flattens_html_lists_and_dicts():
+    assert _to_text(DISCLAIMER_HTML) == "Lease for $399/month for 36 months. MSRP $45,120. Stock #J1234. Taxes, title and fees extra."
+    assert _to_text(["Leather", None, "", ["Sunroof", 2]]) == "Leather, Sunroof, 2"
+    assert _to_text({"term": 36}) == '{"term": 36}'
+    assert _to_text(None) == ""
+    assert _to_text("  3.9%   APR ") == "3.9% APR"
+
+
+def test_listings_from_matching_responses_are_deduplicated():
+    listings, disclaimers = listings_from_responses(RESPONSES, MAPPING)
+
+    assert [listing["Car Name"] for listing in listings] == ["2025 Jeep Grand Cherokee", "2025 Jeep Compass", "2025 Jeep Wrangler"]
+    assert listings[0] == {"Car Name": "2025 Jeep Grand Cherokee", "MSRP": "$45,120", "Features": "Leather, Sunroof"}
+    assert disclaimers[0].startswith("Lease for $399/month") and "Stock #J1234" in disclaimers[0]
+    assert disclaimers[1:] == ["", ""]
+
+
+def test_listings_without_disclaimer_mapping_or_matching_url():
+    mapping = dict(MAPPING, disclaimer=None)
+    listings, disclaimers = listings_from_responses(RESPONSES, mapping)
+    assert len(listings) == 3 and disclaimers == ["", "", ""]
+
+    assert listings_from_responses(RESPONSES, dict(MAPPING, url_pattern=r"/api/inventory")) == ([], [])
+
+
+def test_select_fields_follows_the_requested_order():
+    listings, _ = listings_from_responses(RESPONSES, MAPPING)
+    fields = ["MSRP", "Disclaimer Breakdown 1", "Car Name"]
+
+    selected = select_fields(listings, fields)
+
+    assert [list(listing) for listing in selected] == [fields] * 3
+    assert selected[2] == {"MSRP": "$49,700", "Disclaimer Breakdown 1": "", "Car Name": "2025 Jeep Wrangler"}
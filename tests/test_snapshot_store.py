@@ -0,0 +1,146 @@
+import os
+import json
+import threading
+from types import SimpleNamespace
+
+from snapshot_store import SnapshotStore, content_hash
+
+URL = "https://dealer.example/specials"
+
+
+class StubSession:
+    """Answers like a server with a fixed ETag, returning 304 when the client already has it."""
+
+    def __init__(self, html="<html>offers</html>", etag='"v1"'):
+        self.html = html
+        self.etag = etag
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append(dict(headers or {}))
+        if headers and headers.get("If-None-Match") == self.etag:
+            return SimpleNamespace(status_code=304, headers={}, text="", raise_for_status=lambda: None)
+        return SimpleNamespace(status_code=200, text=self.html, raise_for_status=lambda: None,
+                               headers={"ETag": self.etag, "Last-Modified": "Mon, 05 Oct 2026 10:00:00 GMT"})
+
+
+def scrape_http(store, session, timestamp):
+    # Same flow as perform_scrape() on the HTTP path
+    run = store.start_run("Custom URL", URL, timestamp)
+    html, changed = store.fetch_http(URL, session=session)
+    run.add_page(html)
+    run.save()
+    return html, changed
+
+
+def test_second_http_fetch_is_conditional_and_served_from_store(tmp_path):
+    store = SnapshotStore(root=str(tmp_path))
+    session = StubSession()
+
+    first = scrape_http(store, session, "20261001_100000")
+    second = scrape_http(store, session, "20261001_110000")
+
+    assert session.requests[0] == {}
+    assert session.requests[1]["If-None-Match"] == '"v1"'
+    assert session.requests[1]["If-Modified-Since"] == "Mon, 05 Oct 2026 10:00:00 GMT"
+    assert first == ("<html>offers</html>", True)
+    assert second == ("<html>offers</html>", False)
+    assert store.latest(URL)["etag"] == '"v1"'
+    # Validators survive a reload of the index
+    assert SnapshotStore(root=str(tmp_path)).latest(URL)["etag"] == '"v1"'
+
+
+def test_identical_content_is_stored_once_and_replayed(tmp_path):
+    store = SnapshotStore(root=str(tmp_path))
+    for timestamp in ("1", "2"):
+        run = store.start_run("Cecconi", URL, timestamp)
+        run.add_ad("<div>ad 1</div>", "<div>modal</div>")
+        run.add_ad("<div>ad 2</div>", "<div>modal</div>")
+        run.save()
+
+    blobs = [name for _, _, names in os.walk(store.blob_dir) for name in names]
+    assert len(blobs) == 3
+    assert store.load_run("Cecconi_2") == ["<div>ad 1</div><div>modal</div>", "<div>ad 2</div><div>modal</div>"]
+    assert store.detail_for(URL, "<div>ad 1</div>") == "<div>modal</div>"
+    assert store.detail_for(URL, "<div>changed ad</div>") is None
+
+
+def test_prune_keeps_newest_runs_per_site_and_drops_unreferenced_blobs(tmp_path):
+    store = SnapshotStore(root=str(tmp_path), max_runs=1, retention_days=0)
+    for timestamp, ad in (("1", "<div>old</div>"), ("2", "<div>new</div>")):
+        run = store.start_run("Towne", URL, timestamp)
+        run.add_ad(ad)
+        run.save()
+    # Index entries keep blobs alive independently of runs; drop them to isolate run retention
+    store._index = {}
+    store.prune()
+
+    assert [r["run_id"] for r in store.list_runs()] == ["Towne_2"]
+    blobs = [name for _, _, names in os.walk(store.blob_dir) for name in names]
+    assert len(blobs) == 1
+    assert store.load_run("Towne_2") == ["<div>new</div>"]
+
+
+def test_prune_expires_runs_past_retention(tmp_path):
+    store = SnapshotStore(root=str(tmp_path), retention_days=30, max_runs=0)
+    run = store.start_run("Towne", URL, "1")
+    run.add_ad("<div>ad</div>")
+    run.save()
+
+    run_path = os.path.join(store.run_dir, "Towne_1.json")
+    with open(run_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    data["created_at"] = "2000-01-01T00:00:00"
+    with open(run_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    for entry in store._index.values():
+        entry["fetched_at"] = "2000-01-01T00:00:00"
+    store.prune()
+
+    assert store.list_runs() == []
+    assert store.latest(store.ad_key(URL, "<div>ad</div>")) is None
+    assert [name for _, _, names in os.walk(store.blob_dir) for name in names] == []
+
+
+def test_concurrent_writes_of_the_same_blob_all_succeed(tmp_path):
+    store = SnapshotStore(root=str(tmp_path))
+    content = "<div>same ad</div>" * 2000
+    for trial in range(20):
+        store.root = str(tmp_path / str(trial))
+        store.blob_dir = os.path.join(store.root, "blobs")
+        barrier = threading.Barrier(4)
+        errors = []
+
+        def write():
+            barrier.wait()
+            try:
+                store.put(content)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert [name for _, _, names in os.walk(store.blob_dir) for name in names] == [content_hash(content) + ".html.gz"]
+        assert store.get(content_hash(content)) == content
+
+
+def test_prune_spares_temp_files_and_blobs_of_runs_in_progress(tmp_path):
+    store = SnapshotStore(root=str(tmp_path), retention_days=0)
+    run = store.start_run("Custom URL", URL, "1")
+    run.add_page("<html>page not saved yet</html>")
+    digest = content_hash("<html>page not saved yet</html>")
+    tmp_blob = store._blob_path(digest) + ".tmpabc123"
+    with open(tmp_blob, "w", encoding="utf-8") as f:
+        f.write("partial")
+
+    store.prune()  # e.g. another session finishing its run
+
+    assert os.path.exists(tmp_blob)
+    assert store.get(digest) == "<html>page not saved yet</html>"
+    run.save()
+    assert store.load_run("Custom-URL_1") == ["<html>page not saved yet</html>"]